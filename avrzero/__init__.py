@@ -1,9 +1,22 @@
 __all__ = [
     "assembler",
+    "batch",
+    "cache",
+    "callgraph",
+    "coverage",
+    "flags",
     "gui",
+    "image",
     "instruction",
+    "journal",
+    "loops",
     "machine",
-    "register"
+    "memory",
+    "profiler",
+    "register",
+    "runner",
+    "trace",
+    "translator"
 ]
 
 __package__ = "avrzero"
@@ -1,20 +1,152 @@
 import argparse
-from pprint import pprint
+import json
+import sys
 
 from avrzero.assembler import Assembler
+from avrzero.callgraph import label_names
+from avrzero.image import save_binary, save_hex
 from avrzero.machine import Machine
+from avrzero.runner import find_sources, run_files, warm_tables
+
+COMMANDS = ("assemble", "batch", "profile")
+
+
+def assemble(args):
+    with open(args.file, "r") as asm_file:
+        asm_source = asm_file.read()
+
+    assembler = Assembler(asm_source)
+    program = assembler.assemble()
+
+    if args.output is None:
+        print(program)
+    elif not assembler.errors:
+        machine = Machine()
+        machine.load_program(program)
+        save = save_hex if args.output.endswith(".hex") else save_binary
+        save(machine.flash, args.output, stop=len(program))
+    for line_no, err in assembler.errors:
+        print(f"{args.file}:{line_no + 1}: {err}", file=sys.stderr)
+    if assembler.errors:
+        sys.exit(1)
+
+
+def batch(args):
+    paths = find_sources(args.sources)
+    results = run_files(paths, max_steps=args.max_steps,
+                        timeout=args.timeout, engine=args.engine,
+                        seed=args.seed, cache_dir=args.cache,
+                        workers=args.workers, max_cycles=args.max_cycles,
+                        coverage=args.coverage,
+                        detect_loops=args.detect_loops)
+    for result in results:
+        print(json.dumps(result), flush=True)
+
+
+def profile(args):
+    with open(args.file, "r") as asm_file:
+        assembler = Assembler(asm_file.read())
+    program = assembler.assemble()
+    for line_no, err in assembler.errors:
+        print(f"{args.file}:{line_no + 1}: {err}", file=sys.stderr)
+    if assembler.errors:
+        sys.exit(1)
+
+    machine = Machine(engine=args.engine, clock_frequency=args.clock)
+    machine.load_program(program)
+    warm_tables()
+    profiler = machine.start_profile()
+    call_graph = machine.start_call_graph()
+    call_graph.names = label_names(assembler)
+    result = machine.run(max_steps=args.max_steps, timeout=args.timeout,
+                         max_cycles=args.max_cycles)
+    print(f"{result.steps} steps, {result.cycles} cycles "
+          f"({1e3 * result.cycles / args.clock:.3f} ms at "
+          f"{args.clock / 1e6:g} MHz), stopped on {result.reason.value}")
+    print()
+    if args.listing:
+        profiler.write_listing(sys.stdout, assembler)
+    else:
+        profiler.write_report(sys.stdout, limit=args.limit)
+        print()
+        call_graph.write_report(sys.stdout, limit=args.limit)
+    if args.trace_events is not None:
+        with open(args.trace_events, "w") as trace_file:
+            call_graph.write_trace_events(trace_file)
+    if args.collapsed is not None:
+        with open(args.collapsed, "w") as collapsed_file:
+            call_graph.write_collapsed(collapsed_file)
 
 
 parser = argparse.ArgumentParser(
     description="a simple AVR instruction set simulator"
 )
-parser.add_argument("file")
-args = parser.parse_args()
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+assemble_parser = subparsers.add_parser(
+    "assemble", help="assemble a file and print the program")
+assemble_parser.add_argument("file")
+assemble_parser.add_argument(
+    "-o", "--output",
+    help="write an Intel HEX (.hex) or raw binary image instead of printing")
+assemble_parser.set_defaults(func=assemble)
 
-with open(args.file, "r") as asm_file:
-    asm_source = file.read()
+batch_parser = subparsers.add_parser(
+    "batch", help="assemble and run many files, one JSON line per file")
+batch_parser.add_argument(
+    "sources", nargs="+",
+    help="assembly files, directories or glob patterns")
+batch_parser.add_argument("--max-steps", type=int, default=1_000_000,
+                          help="maximum number of steps per file")
+batch_parser.add_argument("--timeout", type=float,
+                          help="maximum seconds of execution per file")
+batch_parser.add_argument("--max-cycles", type=int,
+                          help="maximum number of simulated cycles per file")
+batch_parser.add_argument("--engine", choices=Machine.ENGINES,
+                          default="interpreter")
+batch_parser.add_argument("--seed", type=int,
+                          help="seed the initial memory of every machine")
+batch_parser.add_argument("--cache", metavar="DIR",
+                          help="reuse assembled programs cached in DIR")
+batch_parser.add_argument("--workers", type=int,
+                          help="number of worker processes")
+batch_parser.add_argument("--coverage", action="store_true",
+                          help="list the source lines that never executed")
+batch_parser.add_argument(
+    "--detect-loops", action="store_true",
+    help="stop a file as non-terminating once its state repeats")
+batch_parser.set_defaults(func=batch)
 
-assembler = Assembler(asm_source)
-machine = Machine()
+profile_parser = subparsers.add_parser(
+    "profile", help="run a file and report where the time went")
+profile_parser.add_argument("file")
+profile_parser.add_argument("--max-steps", type=int, default=1_000_000,
+                            help="maximum number of steps")
+profile_parser.add_argument("--timeout", type=float,
+                            help="maximum seconds of execution")
+profile_parser.add_argument("--max-cycles", type=int,
+                            help="maximum number of simulated cycles")
+profile_parser.add_argument("--clock", type=float, default=16_000_000,
+                            help="simulated clock frequency in Hz")
+profile_parser.add_argument("--engine", choices=Machine.ENGINES,
+                            default="interpreter")
+profile_parser.add_argument("--limit", type=int, default=20,
+                            help="number of rows per table")
+profile_parser.add_argument(
+    "--listing", action="store_true",
+    help="print the source with the count of each line instead")
+profile_parser.add_argument(
+    "--trace-events", metavar="FILE",
+    help="write the subroutine calls as Chrome trace event JSON")
+profile_parser.add_argument(
+    "--collapsed", metavar="FILE",
+    help="write the cycles of each call path as collapsed stacks")
+profile_parser.set_defaults(func=profile)
 
-print(assembler.assemble())
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith("-"):
+        # python -m avrzero FILE still assembles FILE
+        argv.insert(0, "assemble")
+    args = parser.parse_args(argv)
+    args.func(args)
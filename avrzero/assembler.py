@@ -1,38 +1,203 @@
+from array import array
+
 from avrzero.error import AVRSyntaxError
 from avrzero.instruction import InstructionSet
 
 
 class Assembler:
 
-    def __init__(self, source, instruction_set=InstructionSet.default):
+    def __init__(self, source="", instruction_set=InstructionSet.default,
+                 cache=None):
         self._source = source.splitlines()
         self._instruction_set = instruction_set
-        self._errors = ()
+        self._cache = cache
+        self._errors = []
+        # address of each line, followed by the end of the program
+        self._addresses = [0]
 
     @property
     def errors(self):
-        return self._errors
+        return tuple(self._errors)
+
+    @property
+    def lines(self):
+        return tuple(self._source)
+
+    def address(self, line_no):
+        return self._addresses[line_no]
 
     @property
     def instruction_set(self):
         return self._instruction_set
 
+    def assemble_line(self, line):
+        """Return the words and the error messages of one source line."""
+        code, delim, comment = line.partition(";")
+        tokens = code.split(None, 1)
+        if not tokens:
+            return (), ()
+        instruction_name = tokens[0]
+        instructions = self._instruction_set.by_name(instruction_name)
+        if not instructions:
+            return (), (f"no instruction named {instruction_name}",)
+        messages = []
+        for instruction in instructions:
+            try:
+                return tuple(instruction.str_to_opcode(code)), ()
+            except AVRSyntaxError as err:
+                messages.append(str(err))
+
+        return (), tuple(messages)
+
+    def iter_assemble(self, lines=None):
+        """Assemble ``lines`` one at a time.
+
+        Yields ``(line_no, address, words)`` for every line, after adding
+        its errors to ``errors``. ``lines`` may be any iterable of strings,
+        such as an open file, and defaults to the source.
+        """
+        if lines is None:
+            lines = self._source
+        self._errors = []
+        errors = self._errors
+        assemble_line = self.assemble_line
+        address = 0
+        for line_no, line in enumerate(lines):
+            words, messages = assemble_line(line.rstrip("\r\n"))
+            for message in messages:
+                errors.append((line_no, message))
+            yield line_no, address, words
+            address += len(words)
+
     def assemble(self):
+        """Assemble the source, or load it from the cache if there is one."""
+        if self._cache is not None:
+            key = self._cache.key("\n".join(self._source),
+                                  self._instruction_set)
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._errors = list(cached.errors)
+                self._addresses = cached.addresses
+                return cached.program
+
         program = []
-        for line_no, line in enumerate(self._source):
-            code, delim, comment = line.partition(";")
-            tokens = code.split()
-            if not tokens:
-                continue
-            instruction_name, *_ = tokens
-            instructions = [*self._instruction_set.by_name(instruction_name)]
-            if not instructions:
-                self._errors += ((line_no,
-                                  f"no instruction named {instruction_name}"),)
-            for instruction in instructions:
-                try:
-                    program.extend(instruction.str_to_opcode(code))
-                except AVRSyntaxError as err:
-                    self._errors += ((line_no, str(err)),)
+        addresses = []
+        for line_no, address, words in self.iter_assemble():
+            addresses.append(address)
+            program.extend(words)
+        addresses.append(len(program))
+        self._addresses = addresses
 
+        if self._cache is not None:
+            self._cache.put(key, program, self._errors, addresses)
         return program
+
+    def write_flash(self, flash, lines=None, chunk_size=1 << 12):
+        """Assemble ``lines`` straight into ``flash``.
+
+        Words are written in chunks of ``chunk_size`` as they are
+        assembled, words that do not fit are dropped and the rest of the
+        flash is cleared, like ``Machine.load_program``. Returns the number
+        of words of the program.
+        """
+        chunk = array("H")
+        start = 0
+        size = len(flash)
+        for line_no, address, words in self.iter_assemble(lines):
+            chunk.extend(words)
+            if len(chunk) >= chunk_size:
+                stop = min(start + len(chunk), size)
+                if start < stop:
+                    flash[start:stop] = chunk[:stop - start]
+                start += len(chunk)
+                del chunk[:]
+        end = start + len(chunk)
+        if start < size:
+            chunk.frombytes(bytes(chunk.itemsize * max(size - end, 0)))
+            flash[start:] = chunk[:size - start]
+        return end
+
+
+class IncrementalAssembler(Assembler):
+    """An assembler that reassembles a source after each edit.
+
+    Results are cached per line text, so an edit only encodes the lines
+    that differ from the previous source, and only the addresses after the
+    edit move.
+    """
+
+    def __init__(self, source="", instruction_set=InstructionSet.default):
+        super().__init__("", instruction_set)
+        self._line_cache = {}
+        # (words, messages) of each line
+        self._results = []
+        self._program = []
+        self.update(source)
+
+    @property
+    def errors(self):
+        return tuple((line_no, message)
+                     for line_no, (words, messages) in enumerate(self._results)
+                     for message in messages)
+
+    @property
+    def program(self):
+        return self._program
+
+    def assemble(self):
+        return list(self._program)
+
+    def _assemble_cached(self, line):
+        result = self._line_cache.get(line)
+        if result is None:
+            result = self._line_cache[line] = self.assemble_line(line)
+        return result
+
+    def update(self, source):
+        """Reassemble the program for ``source``.
+
+        Returns the ``(start, stop)`` range of words that changed.
+        """
+        lines = source.splitlines()
+        old_lines = self._source
+        n_lines = min(len(old_lines), len(lines))
+        prefix = 0
+        while prefix < n_lines and old_lines[prefix] == lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < n_lines - prefix
+               and old_lines[-1 - suffix] == lines[-1 - suffix]):
+            suffix += 1
+        old_stop = len(old_lines) - suffix
+        new_stop = len(lines) - suffix
+
+        addresses = self._addresses
+        program = self._program
+        old_size = len(program)
+        results = [self._assemble_cached(line)
+                   for line in lines[prefix:new_stop]]
+        start = addresses[prefix]
+        old_end = addresses[old_stop]
+        new_addresses = []
+        new_end = start
+        for words, messages in results:
+            new_addresses.append(new_end)
+            new_end += len(words)
+        program[start:old_end] = [word for words, messages in results
+                                  for word in words]
+        shift = new_end - old_end
+        tail = addresses[old_stop:]
+        if shift:
+            tail = [address + shift for address in tail]
+        addresses[prefix:] = new_addresses + tail
+        self._results[prefix:old_stop] = results
+        self._source = lines
+
+        if len(self._line_cache) > 2 * len(lines) + 1024:
+            line_cache = self._line_cache
+            self._line_cache = {line: line_cache[line] for line in lines
+                                if line in line_cache}
+
+        if shift:
+            return start, max(old_size, len(program))
+        return start, new_end
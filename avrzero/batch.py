@@ -0,0 +1,314 @@
+from collections import namedtuple
+from random import getrandbits
+from time import perf_counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from avrzero import flags
+from avrzero.error import AVRMachineError
+from avrzero.instruction import (BYTE_SIZE, InstructionSet, SPH_ADDR,
+                                 SPL_ADDR, SREG_ADDR, X_ADDR)
+from avrzero.instruction import (adc, add, bclr, call, ld, ld_post_inc,
+                                 ld_pre_dec, ldi, nop, pop, push, ret)
+from avrzero.memory import Flash
+
+BatchRunResult = namedtuple("BatchRunResult",
+                            ("steps", "halted", "elapsed", "rate"))
+
+# instruction -> action(batch, lanes, **operand_map) over an index array
+VECTOR_ACTIONS = {}
+
+
+def vectorize(instruction):
+    def decorator(action):
+        VECTOR_ACTIONS[instruction] = action
+        return action
+
+    return decorator
+
+
+class BatchMachine:
+    """Many machines running one program in lockstep on NumPy arrays.
+
+    Every lane has its own data memory (and with it registers, SP and
+    SREG) and program counter, and all lanes share the flash. Each step
+    executes one instruction in every lane that has not halted. Lanes are
+    grouped by program counter, and each group runs the vectorized action
+    of its instruction over all of its lanes at once.
+    """
+
+    def __init__(self, n_lanes, RAMEND=0xFFFF, flash_size=0x10000,
+                 instruction_set=InstructionSet.default):
+        if np is None:
+            raise ImportError("BatchMachine requires numpy, "
+                              "install avrzero[batch]")
+        # === Data Memory ===
+        self.RAMEND = RAMEND
+        rng = np.random.default_rng(getrandbits(64))
+        self.memory = rng.integers(0, 1 << BYTE_SIZE,
+                                   size=(n_lanes, RAMEND + 1), dtype=np.uint8)
+        self.R = self.general_registers = self.memory[:, 0x00:0x20]
+
+        # === Program Memory ===
+        self.flash_size = flash_size
+        self.flash = Flash(flash_size)
+        self.flash.add_listener(self._invalidate_decoded)
+        self.pc = np.zeros(n_lanes, dtype=np.int64)
+
+        # === Instruction Set ===
+        self.instruction_set = instruction_set
+        self._decoded = {}
+
+        self.steps = np.zeros(n_lanes, dtype=np.int64)
+        self.halted = np.zeros(n_lanes, dtype=bool)
+
+        # === Reset ===
+        self.reset()
+
+    def __repr__(self):
+        return "\n".join((
+            f"BatchMachine(n_lanes={self.n_lanes},",
+            f"             RAMEND={self.RAMEND},",
+            f"             flash_size={self.flash_size},",
+            f"             instruction_set={self.instruction_set!r})"))
+
+    def __len__(self):
+        return self.n_lanes
+
+    @property
+    def n_lanes(self):
+        return len(self.pc)
+
+    @property
+    def SP(self):
+        return (self.memory[:, SPH_ADDR].astype(np.int64) << BYTE_SIZE
+                | self.memory[:, SPL_ADDR])
+
+    @SP.setter
+    def SP(self, val):
+        val = np.asarray(val, dtype=np.int64) & 0xFFFF
+        self.memory[:, SPH_ADDR] = val >> BYTE_SIZE
+        self.memory[:, SPL_ADDR] = val & 0xFF
+
+    @property
+    def SREG(self):
+        return self.memory[:, SREG_ADDR]
+
+    def reset(self):
+        self.SP = self.RAMEND
+        self.pc[:] = 0x0000
+        self.steps[:] = 0
+        self.halted[:] = False
+
+    def load_program(self, program, start=0, stop=None):
+        """Write ``program`` to flash, see ``Flash.load``."""
+        self.flash.load(program, start, stop)
+
+    def load_lane(self, lane, machine):
+        """Copy the state of a ``Machine`` into a lane."""
+        machine.SREG.flush()
+        self.memory[lane] = np.frombuffer(machine.memory.data, np.uint8)
+        self.pc[lane] = machine.pc
+
+    def store_lane(self, lane, machine):
+        """Copy the state of a lane into a ``Machine``."""
+        machine.memory.data[:] = self.memory[lane].tobytes()
+        machine.pc = int(self.pc[lane])
+
+    def _invalidate_decoded(self, start, stop):
+        self._decoded.clear()
+
+    def _decode(self, pc):
+        entry = self._decoded.get(pc, False)
+        if entry is False:
+            entry = None
+            decoded = self.instruction_set.decode(self.flash, pc)
+            if decoded is not None:
+                instruction, operand_map = decoded
+                action = VECTOR_ACTIONS.get(instruction)
+                if action is None:
+                    raise AVRMachineError(
+                        f"no vectorized action for {instruction.name}")
+                entry = (action, operand_map)
+            self._decoded[pc] = entry
+        return entry
+
+    def step(self):
+        """Execute one instruction in every running lane.
+
+        Returns the number of lanes that executed an instruction.
+        """
+        running = np.flatnonzero(~self.halted)
+        if not len(running):
+            return 0
+        pcs = self.pc[running]
+        unique_pcs, inverse = np.unique(pcs, return_inverse=True)
+        if len(unique_pcs) == 1:
+            groups = (running,)
+        else:
+            order = np.argsort(inverse, kind="stable")
+            bounds = np.cumsum(np.bincount(inverse))[:-1]
+            groups = np.split(running[order], bounds)
+
+        executed = 0
+        for pc, lanes in zip(unique_pcs.tolist(), groups):
+            entry = self._decode(pc)
+            if entry is None:
+                self.halted[lanes] = True
+                continue
+            action, operand_map = entry
+            action(self, lanes, **operand_map)
+            self.steps[lanes] += 1
+            executed += len(lanes)
+        return executed
+
+    def run(self, max_steps):
+        """Step all lanes until each has halted or run ``max_steps``."""
+        start = perf_counter()
+        executed = 0
+        for _ in range(max_steps):
+            n_lanes = self.step()
+            if not n_lanes:
+                break
+            executed += n_lanes
+        elapsed = perf_counter() - start
+        rate = executed / elapsed if elapsed else float("inf")
+        return BatchRunResult(self.steps.copy(), self.halted.copy(),
+                              elapsed, rate)
+
+
+# === Vectorized Actions ===
+
+def _word(memory, lanes, high, low):
+    return memory[lanes, high].astype(np.int64) << BYTE_SIZE \
+        | memory[lanes, low]
+
+
+def _set_word(memory, lanes, high, low, val):
+    memory[lanes, high] = val >> BYTE_SIZE
+    memory[lanes, low] = val & 0xFF
+
+
+def _next(batch, lanes):
+    batch.pc[lanes] = batch.pc[lanes] + 1 & 0xFFFF
+
+
+# FlagTable -> NumPy view of its table
+_FLAG_TABLES = {}
+
+
+def _flag_table(table):
+    view = _FLAG_TABLES.get(table)
+    if view is None:
+        view = _FLAG_TABLES[table] = np.frombuffer(
+            table.table, f"u{table.table.itemsize}")
+    return view
+
+
+def _add(batch, lanes, d, r, carry):
+    memory = batch.memory
+    index = carry << 16 | memory[lanes, d].astype(np.int64) << 8 \
+        | memory[lanes, r]
+    entry = _flag_table(flags.ADD)[index]
+    memory[lanes, d] = entry & 0xFF
+    memory[lanes, SREG_ADDR] = \
+        memory[lanes, SREG_ADDR] & (entry >> 16) | (entry >> 8 & 0xFF)
+    _next(batch, lanes)
+
+
+@vectorize(adc)
+def _adc(batch, lanes, d, r):
+    carry = batch.memory[lanes, SREG_ADDR].astype(np.int64) & 1
+    _add(batch, lanes, d, r, carry)
+
+
+@vectorize(add)
+def _add_no_carry(batch, lanes, d, r):
+    _add(batch, lanes, d, r, 0)
+
+
+@vectorize(bclr)
+def _bclr(batch, lanes, s):
+    batch.memory[lanes, SREG_ADDR] &= ~(1 << s) & 0xFF
+    _next(batch, lanes)
+
+
+def _push_byte(memory, lanes, val):
+    sp = _word(memory, lanes, SPH_ADDR, SPL_ADDR) - 1 & 0xFFFF
+    _set_word(memory, lanes, SPH_ADDR, SPL_ADDR, sp)
+    memory[lanes, sp] = val
+
+
+def _pop_byte(memory, lanes):
+    sp = _word(memory, lanes, SPH_ADDR, SPL_ADDR)
+    val = memory[lanes, sp]
+    _set_word(memory, lanes, SPH_ADDR, SPL_ADDR, sp + 1 & 0xFFFF)
+    return val
+
+
+@vectorize(call)
+def _call(batch, lanes, k):
+    ret_addr = batch.pc[lanes] + 2 & 0xFFFF
+    _push_byte(batch.memory, lanes, ret_addr & 0xFF)
+    _push_byte(batch.memory, lanes, ret_addr >> BYTE_SIZE)
+    batch.pc[lanes] = k
+
+
+@vectorize(ld)
+def _ld(batch, lanes, d):
+    memory = batch.memory
+    x = _word(memory, lanes, X_ADDR + 1, X_ADDR)
+    memory[lanes, d] = memory[lanes, x]
+    _next(batch, lanes)
+
+
+@vectorize(ld_post_inc)
+def _ld_post_inc(batch, lanes, d):
+    memory = batch.memory
+    x = _word(memory, lanes, X_ADDR + 1, X_ADDR)
+    memory[lanes, d] = memory[lanes, x]
+    x = _word(memory, lanes, X_ADDR + 1, X_ADDR) + 1 & 0xFFFF
+    _set_word(memory, lanes, X_ADDR + 1, X_ADDR, x)
+    _next(batch, lanes)
+
+
+@vectorize(ld_pre_dec)
+def _ld_pre_dec(batch, lanes, d):
+    memory = batch.memory
+    x = _word(memory, lanes, X_ADDR + 1, X_ADDR) - 1 & 0xFFFF
+    _set_word(memory, lanes, X_ADDR + 1, X_ADDR, x)
+    memory[lanes, d] = memory[lanes, x]
+    _next(batch, lanes)
+
+
+@vectorize(ldi)
+def _ldi(batch, lanes, d, k):
+    batch.memory[lanes, d] = k
+    _next(batch, lanes)
+
+
+@vectorize(nop)
+def _nop(batch, lanes):
+    _next(batch, lanes)
+
+
+@vectorize(pop)
+def _pop(batch, lanes, d):
+    batch.memory[lanes, d] = _pop_byte(batch.memory, lanes)
+    _next(batch, lanes)
+
+
+@vectorize(push)
+def _push(batch, lanes, d):
+    _push_byte(batch.memory, lanes, batch.memory[lanes, d])
+    _next(batch, lanes)
+
+
+@vectorize(ret)
+def _ret(batch, lanes):
+    high = _pop_byte(batch.memory, lanes).astype(np.int64)
+    low = _pop_byte(batch.memory, lanes)
+    batch.pc[lanes] = high << BYTE_SIZE | low
@@ -0,0 +1,193 @@
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from collections import namedtuple
+
+CachedAssembly = namedtuple("CachedAssembly",
+                            ("program", "errors", "addresses"))
+
+# magic, version, number of program words, addresses and errors
+_HEADER = struct.Struct("<4sHIII")
+# line number and length in bytes of the message that follows
+_ERROR = struct.Struct("<II")
+_MAGIC = b"AVRZ"
+_VERSION = 1
+
+
+def _little_endian(words):
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+class AssemblyCache:
+    """A directory of assembled programs keyed by source and instruction set.
+
+    Each entry is one binary file holding the program words, the errors
+    and the address of every line. Entries are read through ``mmap``. Once
+    the files exceed ``max_size`` bytes, the least recently used ones are
+    deleted until they fit in ``LOW_WATER`` of it.
+    """
+
+    SUFFIX = ".avrz"
+    LOW_WATER = 0.75
+
+    def __init__(self, directory, max_size=1 << 26):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_size = max_size
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        # the total size of the entries, kept without scanning on each put
+        self._size = sum(size for _, size, _ in self._stat_entries())
+
+    def __repr__(self):
+        return (f"AssemblyCache({self._directory!r}, "
+                f"max_size={self._max_size})")
+
+    def __len__(self):
+        return sum(1 for _ in self._entries())
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @property
+    def evictions(self):
+        return self._evictions
+
+    @staticmethod
+    def key(source, instruction_set):
+        digest = hashlib.sha256(instruction_set.fingerprint.encode())
+        digest.update(source.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + self.SUFFIX)
+
+    def _entries(self):
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(self.SUFFIX) and entry.is_file():
+                    yield entry
+
+    def get(self, key):
+        """Return the ``CachedAssembly`` stored under ``key`` or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as cache_file, \
+                    mmap.mmap(cache_file.fileno(), 0,
+                              access=mmap.ACCESS_READ) as view:
+                entry = self._read(view)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, ValueError, struct.error, UnicodeDecodeError):
+            entry = None
+        if entry is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return entry
+
+    def put(self, key, program, errors, addresses):
+        path = self._path(key)
+        fd, temp_path = tempfile.mkstemp(dir=self._directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as cache_file:
+                self._write(cache_file, program, errors, addresses)
+                size = cache_file.tell()
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._size += size - replaced
+        if self._size > self._max_size:
+            self._evict()
+
+    def clear(self):
+        for entry in list(self._entries()):
+            os.unlink(entry.path)
+        self._size = 0
+
+    def _stat_entries(self):
+        for entry in self._entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, entry.path
+
+    def _evict(self):
+        # rescan, as other processes may share the directory
+        entries = sorted(self._stat_entries())
+        total = sum(size for _, size, _ in entries)
+        low_water = self._max_size * self.LOW_WATER
+        for mtime, size, path in entries:
+            if total <= low_water:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self._evictions += 1
+        self._size = total
+
+    @staticmethod
+    def _write(cache_file, program, errors, addresses):
+        cache_file.write(_HEADER.pack(_MAGIC, _VERSION, len(program),
+                                      len(addresses), len(errors)))
+        cache_file.write(_little_endian(array("H", program)).tobytes())
+        cache_file.write(_little_endian(array("I", addresses)).tobytes())
+        for line_no, message in errors:
+            message = message.encode()
+            cache_file.write(_ERROR.pack(line_no, len(message)))
+            cache_file.write(message)
+
+    @staticmethod
+    def _read(view):
+        magic, version, n_words, n_addresses, n_errors = \
+            _HEADER.unpack_from(view)
+        if magic != _MAGIC or version != _VERSION:
+            return None
+        offset = _HEADER.size
+        program = array("H")
+        program.frombytes(view[offset:offset + n_words * program.itemsize])
+        offset += n_words * program.itemsize
+        addresses = array("I")
+        addresses.frombytes(
+            view[offset:offset + n_addresses * addresses.itemsize])
+        offset += n_addresses * addresses.itemsize
+        errors = []
+        for _ in range(n_errors):
+            line_no, length = _ERROR.unpack_from(view, offset)
+            offset += _ERROR.size
+            errors.append((line_no, view[offset:offset + length].decode()))
+            offset += length
+        if (len(program) != n_words or len(addresses) != n_addresses
+                or offset != len(view)):
+            return None
+        return CachedAssembly(_little_endian(program).tolist(),
+                              tuple(errors),
+                              _little_endian(addresses).tolist())
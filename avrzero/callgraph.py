@@ -0,0 +1,229 @@
+import json
+import re
+from array import array
+from collections import namedtuple
+
+# a "; [label] name" comment names the address of its line
+LABEL_PATTERN = re.compile(r";\s*\[label\]\s*(.*\S)")
+
+FunctionProfile = namedtuple("FunctionProfile", (
+    "address", "name", "calls", "steps", "cycles",
+    "inclusive_steps", "inclusive_cycles"))
+
+
+def label_names(assembler):
+    """Map the address of each ``; [label] name`` comment to the name."""
+    names = {}
+    for line_no, line in enumerate(assembler.lines):
+        match = LABEL_PATTERN.search(line)
+        if match is not None:
+            names.setdefault(assembler.address(line_no), match.group(1))
+    return names
+
+
+class CallGraph:
+    """The subroutines a machine called, and what they cost.
+
+    Every chain of ``CALL`` instructions from the root is a node of a
+    calling context tree, interned the first time it is reached, so memory
+    grows with the number of distinct call paths rather than with the
+    number of calls. Each instruction's step and cycles go to the innermost
+    node. The first ``max_events`` calls and returns are also kept, with
+    the cycle count at which they happened, for trace export.
+    """
+
+    def __init__(self, machine, max_events=1 << 20):
+        if max_events < 0:
+            raise ValueError("invalid max events, expect a non-negative int")
+        self._machine = machine
+        self._max_events = max_events
+        instruction_set = machine.instruction_set
+        self._calls = frozenset(instruction_set.by_name("CALL"))
+        self._branches = self._calls | frozenset(
+            instruction_set.by_name("RET"))
+        # address -> name, such as from label_names
+        self.names = {}
+        self.clear()
+
+    @property
+    def max_events(self):
+        return self._max_events
+
+    @property
+    def dropped(self):
+        """The number of calls and returns past ``max_events``."""
+        return self._dropped
+
+    def clear(self):
+        """Forget everything and make the current PC the root."""
+        # per node, the root is node 0
+        self._parents = array("q", (-1,))
+        self._addresses = array("q", (self._machine.pc,))
+        self._n_calls = array("Q", (0,))
+        self._steps = array("Q", (0,))
+        self._cycles = array("Q", (0,))
+        # (parent, address) -> node
+        self._children = {}
+        self._node = 0
+        # not yet added to the current node
+        self._pending_steps = 0
+        self._pending_cycles = 0
+        # a node when it is entered, its complement when it is left
+        self._event_nodes = array("q")
+        self._event_cycles = array("Q")
+        self._dropped = 0
+        self._start_cycles = self._machine.cycles
+
+    def record(self, instruction, cycles):
+        """Account for the instruction that just executed."""
+        self._pending_steps += 1
+        self._pending_cycles += cycles
+        if instruction in self._branches:
+            self._flush()
+            if instruction in self._calls:
+                self._enter(self._machine.pc)
+            else:
+                self._leave()
+
+    def _flush(self):
+        node = self._node
+        self._steps[node] += self._pending_steps
+        self._cycles[node] += self._pending_cycles
+        self._pending_steps = self._pending_cycles = 0
+
+    def _event(self, code):
+        if len(self._event_nodes) < self._max_events:
+            self._event_nodes.append(code)
+            self._event_cycles.append(self._machine.cycles)
+        else:
+            self._dropped += 1
+
+    def _enter(self, address):
+        key = self._node, address
+        node = self._children.get(key)
+        if node is None:
+            node = self._children[key] = len(self._parents)
+            self._parents.append(self._node)
+            self._addresses.append(address)
+            self._n_calls.append(0)
+            self._steps.append(0)
+            self._cycles.append(0)
+        self._n_calls[node] += 1
+        self._node = node
+        self._event(node)
+
+    def _leave(self):
+        # a return without a call stays at the root
+        if self._node:
+            self._event(~self._node)
+            self._node = self._parents[self._node]
+
+    def name(self, node):
+        address = self._addresses[node]
+        return self.names.get(address, f"0x{address:04X}")
+
+    def stack(self, node):
+        """Return the nodes from the root to ``node``."""
+        nodes = []
+        while node >= 0:
+            nodes.append(node)
+            node = self._parents[node]
+        return nodes[::-1]
+
+    def functions(self):
+        """Return a ``FunctionProfile`` per subroutine, costliest first.
+
+        Inclusive counts of a recursive subroutine count its outermost
+        calls only.
+        """
+        self._flush()
+        n_nodes = len(self._parents)
+        inclusive_steps = self._steps.tolist()
+        inclusive_cycles = self._cycles.tolist()
+        # children always come after their parent
+        for node in range(n_nodes - 1, 0, -1):
+            parent = self._parents[node]
+            inclusive_steps[parent] += inclusive_steps[node]
+            inclusive_cycles[parent] += inclusive_cycles[node]
+
+        totals = {}
+        for node in range(n_nodes):
+            address = self._addresses[node]
+            total = totals.get(address)
+            if total is None:
+                total = totals[address] = [self.name(node), 0, 0, 0, 0, 0]
+            total[1] += self._n_calls[node]
+            total[2] += self._steps[node]
+            total[3] += self._cycles[node]
+            ancestor = self._parents[node]
+            while ancestor >= 0 and self._addresses[ancestor] != address:
+                ancestor = self._parents[ancestor]
+            if ancestor < 0:
+                total[4] += inclusive_steps[node]
+                total[5] += inclusive_cycles[node]
+        profiles = [FunctionProfile(address, *total)
+                    for address, total in totals.items()]
+        profiles.sort(key=lambda profile: profile.inclusive_cycles,
+                      reverse=True)
+        return profiles
+
+    def write_report(self, file, limit=20):
+        """Write the inclusive and exclusive cost of each subroutine."""
+        file.write(f"{'subroutine':<24} {'calls':>10} {'steps':>12} "
+                   f"{'cycles':>12} {'incl steps':>12} {'incl cycles':>12}\n")
+        for profile in self.functions()[:limit]:
+            file.write(f"{profile.name:<24} {profile.calls:>10} "
+                       f"{profile.steps:>12} {profile.cycles:>12} "
+                       f"{profile.inclusive_steps:>12} "
+                       f"{profile.inclusive_cycles:>12}\n")
+
+    def write_collapsed(self, file, weight="cycles"):
+        """Write one ``root;caller;callee count`` line per call path.
+
+        The count is the exclusive ``"cycles"`` or ``"steps"`` of the path,
+        in the collapsed stack format that flame graph tools read.
+        """
+        if weight not in ("cycles", "steps"):
+            raise ValueError("invalid weight, expect 'cycles' or 'steps'")
+        self._flush()
+        counts = self._cycles if weight == "cycles" else self._steps
+        for node, count in enumerate(counts):
+            if count:
+                frames = ";".join(self.name(frame).replace(";", ":")
+                                  for frame in self.stack(node))
+                file.write(f"{frames} {count}\n")
+
+    def write_trace_events(self, file):
+        """Write the recorded calls as Chrome trace event JSON.
+
+        Timestamps are simulated microseconds from when the graph was
+        cleared. Calls still open at the end are closed there. The events
+        are written one at a time, so memory stays flat.
+        """
+        self._flush()
+        start = self._start_cycles
+        scale = 1e6 / self._machine.clock_frequency
+
+        def write(node, phase, cycles):
+            file.write(json.dumps({
+                "name": self.name(node), "ph": phase,
+                "ts": (cycles - start) * scale, "pid": 0, "tid": 0}))
+
+        file.write('{"traceEvents": [\n')
+        write(0, "B", start)
+        stack = [0]
+        for code, cycles in zip(self._event_nodes, self._event_cycles):
+            file.write(",\n")
+            if code >= 0:
+                stack.append(code)
+                write(code, "B", cycles)
+            else:
+                stack.pop()
+                write(~code, "E", cycles)
+        end = self._machine.cycles
+        if self._dropped:
+            end = self._event_cycles[-1] if self._event_cycles else start
+        for node in reversed(stack):
+            file.write(",\n")
+            write(node, "E", end)
+        file.write('\n], "displayTimeUnit": "ns"}\n')
@@ -0,0 +1,131 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _popcount(data):
+    return bin(int.from_bytes(data, "little")).count("1")
+
+
+class Coverage:
+    """The flash addresses at which an instruction was executed.
+
+    One bit per flash word, where word ``address`` is bit ``address % 8``
+    of byte ``address // 8`` of a ``bytearray``. Maps of the same flash
+    size merge with a bitwise OR and travel between processes as bytes.
+    """
+    # maps ORed in one NumPy reduction
+    MERGE_CHUNK = 1 << 10
+
+    def __init__(self, n_words, data=None):
+        size = -(-n_words // 8)
+        if data is None:
+            data = bytes(size)
+        elif len(data) != size:
+            raise ValueError(f"invalid data length, expect {size} bytes")
+        self._n_words = n_words
+        self._bits = bytearray(data)
+
+    def __repr__(self):
+        return f"Coverage({self._n_words}, {bytes(self._bits)!r})"
+
+    def __len__(self):
+        return self._n_words
+
+    def __contains__(self, address):
+        return (0 <= address < self._n_words
+                and bool(self._bits[address >> 3] >> (address & 7) & 1))
+
+    def __eq__(self, other):
+        if not isinstance(other, Coverage):
+            return NotImplemented
+        return self._n_words == other._n_words and self._bits == other._bits
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __or__(self, other):
+        return Coverage.merge((self, other))
+
+    @property
+    def bits(self):
+        return self._bits
+
+    def tobytes(self):
+        return bytes(self._bits)
+
+    def clear(self):
+        self._bits[:] = bytes(len(self._bits))
+
+    def mark(self, address):
+        self._bits[address >> 3] |= 1 << (address & 7)
+
+    def count(self):
+        """Return the number of covered addresses."""
+        return _popcount(self._bits)
+
+    def addresses(self):
+        """Yield the covered addresses in order."""
+        for index, byte in enumerate(self._bits):
+            while byte:
+                low = byte & -byte
+                yield index << 3 | low.bit_length() - 1
+                byte ^= low
+
+    def update(self, *others):
+        """Add the addresses covered by ``others``."""
+        merged = Coverage.merge((self,) + others)
+        self._bits[:] = merged.bits
+
+    @classmethod
+    def merge(cls, maps):
+        """Return the union of coverage maps of the same size.
+
+        With NumPy installed, maps are ORed by ``MERGE_CHUNK`` at a time in
+        one vectorized reduction each. Otherwise each map is ORed in as one
+        big integer.
+        """
+        maps = list(maps)
+        if not maps:
+            raise ValueError("invalid maps, expect at least one")
+        n_words = len(maps[0])
+        if any(len(coverage) != n_words for coverage in maps):
+            raise ValueError("invalid maps, expect the same flash size")
+        size = len(maps[0].bits)
+        if np is not None and size:
+            dtype = np.uint64 if size % 8 == 0 else np.uint8
+            merged = np.zeros(size // np.dtype(dtype).itemsize, dtype)
+            for start in range(0, len(maps), cls.MERGE_CHUNK):
+                chunk = maps[start:start + cls.MERGE_CHUNK]
+                stacked = np.frombuffer(
+                    b"".join(coverage.bits for coverage in chunk),
+                    dtype=dtype).reshape(len(chunk), -1)
+                merged |= np.bitwise_or.reduce(stacked, axis=0)
+            return cls(n_words, merged.tobytes())
+        merged = 0
+        for coverage in maps:
+            merged |= int.from_bytes(coverage.bits, "little")
+        return cls(n_words, merged.to_bytes(size, "little"))
+
+    def lines(self, assembler):
+        """Yield (line_no, covered) per source line that assembles to words."""
+        for line_no in range(len(assembler.lines)):
+            address = assembler.address(line_no)
+            if assembler.address(line_no + 1) > address:
+                yield line_no, address in self
+
+    def missed_lines(self, assembler):
+        """Return the line numbers of the lines that never executed."""
+        return [line_no for line_no, covered in self.lines(assembler)
+                if not covered]
+
+    def write_report(self, file, assembler):
+        """Write the source with the lines that never executed marked."""
+        lines = dict(self.lines(assembler))
+        covered = sum(lines.values())
+        file.write(f"{covered} of {len(lines)} lines executed\n")
+        for line_no, line in enumerate(assembler.lines):
+            mark = "!" if lines.get(line_no) is False else " "
+            file.write(f"{mark} {line}".rstrip() + "\n")
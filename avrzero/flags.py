@@ -0,0 +1,112 @@
+from array import array
+from functools import cached_property
+
+# SREG bit masks
+C, Z, N, V, S, H, T, I = (1 << bit for bit in range(8))
+# the flags of an 8-bit arithmetic result
+ARITHMETIC = C | Z | N | V | S | H
+
+
+class FlagTable:
+    """Results and SREG updates of an 8-bit operation for all operands.
+
+    Each entry packs the SREG bits to keep, the SREG bits to set and the
+    result as ``keep << 16 | flags << 8 | result``, so that an instruction
+    updates SREG with one lookup and one store. Tables are indexed by
+    ``carry << 16 | rd << 8 | rr`` and built on first use.
+    """
+
+    def __init__(self, name, mask, compute, carry=False, sticky_zero=False):
+        self._name = name
+        self._mask = mask
+        self._compute = compute
+        self._carry = carry
+        self._sticky_zero = sticky_zero
+        self._overwrites = (mask & ARITHMETIC == ARITHMETIC
+                            and not sticky_zero)
+
+    def __repr__(self):
+        return f"FlagTable({self._name!r})"
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @property
+    def overwrites(self):
+        """Whether every entry sets C, Z, N, V, S and H regardless of SREG."""
+        return self._overwrites
+
+    @cached_property
+    def table(self):
+        size = 1 << (16 + self._carry)
+        table = array("I", bytes(4 * size))
+        compute = self._compute
+        for index in range(size):
+            result, flags = compute(index >> 8 & 0xFF, index & 0xFF,
+                                    index >> 16)
+            result &= 0xFF
+            keep = ~self._mask & 0xFF
+            if self._sticky_zero and result == 0:
+                # Z keeps its previous value instead of being set
+                keep |= Z
+                flags &= ~Z
+            table[index] = keep << 16 | (flags & self._mask) << 8 | result
+        return table
+
+    def lookup(self, rd, rr, carry=0):
+        return self.table[carry << 16 | rd << 8 | rr]
+
+    def apply(self, SREG, rd, rr, carry=0):
+        """Update the ``SREG`` status register and return the result."""
+        index = carry << 16 | rd << 8 | rr
+        SREG.defer(self, index)
+        return self.table[index] & 0xFF
+
+
+def _sign_flags(flags, result, overflow):
+    flags |= (result >> 7) * N
+    flags |= overflow * V
+    flags |= ((result >> 7) ^ overflow) * S
+    flags |= (result == 0) * Z
+    return flags
+
+
+def _add(rd, rr, carry):
+    result = rd + rr + carry
+    flags = (result >> 8) * C
+    flags |= (((rd & 0xF) + (rr & 0xF) + carry) >> 4) * H
+    overflow = (~(rd ^ rr) & (rd ^ result)) >> 7 & 1
+    return result, _sign_flags(flags, result & 0xFF, overflow)
+
+
+def _sub(rd, rr, carry):
+    result = rd - rr - carry
+    flags = (result < 0) * C
+    flags |= ((rd & 0xF) - (rr & 0xF) - carry < 0) * H
+    overflow = ((rd ^ rr) & (rd ^ result)) >> 7 & 1
+    return result, _sign_flags(flags, result & 0xFF, overflow)
+
+
+def _logic(operator):
+    def compute(rd, rr, carry):
+        result = operator(rd, rr)
+        return result, _sign_flags(0, result, 0)
+    return compute
+
+
+# ADD and ADC
+ADD = FlagTable("add", C | Z | N | V | S | H, _add, carry=True)
+# SUB, SUBI and CP
+SUB = FlagTable("sub", C | Z | N | V | S | H, _sub)
+# SBC, SBCI and CPC, where a zero result leaves Z unchanged
+SBC = FlagTable("sbc", C | Z | N | V | S | H, _sub, carry=True,
+                sticky_zero=True)
+# AND, ANDI, OR, ORI and EOR
+AND = FlagTable("and", Z | N | V | S, _logic(lambda rd, rr: rd & rr))
+OR = FlagTable("or", Z | N | V | S, _logic(lambda rd, rr: rd | rr))
+EOR = FlagTable("eor", Z | N | V | S, _logic(lambda rd, rr: rd ^ rr))
@@ -2,8 +2,9 @@ import math
 import tkinter.filedialog
 import tkinter as tk
 
-from avrzero.assembler import Assembler
-from avrzero.machine import Machine
+from avrzero.assembler import IncrementalAssembler
+from avrzero.error import AVRMachineError
+from avrzero.machine import Machine, StopReason
 
 
 class CodeText(tk.Text):
@@ -11,6 +12,21 @@ class CodeText(tk.Text):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.lab_err_ls = {}
+        self.breakpoints = set()
+        self.tag_configure("breakpoint", background="orange")
+        self.bind("<Double-Button-1>", self.toggle_breakpoint)
+
+    def toggle_breakpoint(self, event):
+        line_no = int(self.index(f"@{event.x},{event.y}").split(".")[0]) - 1
+        if line_no in self.breakpoints:
+            self.breakpoints.remove(line_no)
+            self.tag_remove("breakpoint",
+                            f"{line_no + 1}.0", f"{line_no + 1}.end")
+        else:
+            self.breakpoints.add(line_no)
+            self.tag_add("breakpoint",
+                         f"{line_no + 1}.0", f"{line_no + 1}.end")
+        return "break"
 
     def tag_error_clear(self):
         for tag, lab in self.lab_err_ls.items():
@@ -113,11 +129,17 @@ class FlashFrame(tk.Frame):
 
 
 class AVRSimTk(tk.Tk):
+    # seconds a click on Run executes before control returns to the user
+    RUN_TIMEOUT = 1.0
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.machine = Machine()
+        self.machine.start_journal()
+        self.assembler = IncrementalAssembler()
+        # range of flash words that differ from the assembled program
+        self._unloaded = None
 
         self.title("AVR Zero")
 
@@ -134,13 +156,23 @@ class AVRSimTk(tk.Tk):
         self.btn_assemble = tk.Button(
             self.frm_toolbar, text="Assemble", command=self.assemble)
         self.btn_assemble.pack(side=tk.LEFT)
+        self.btn_run = tk.Button(
+            self.frm_toolbar, text="Run", command=self.run)
+        self.btn_run.pack(side=tk.RIGHT)
         self.btn_step = tk.Button(
             self.frm_toolbar, text="Step", command=self.step)
         self.btn_step.pack(side=tk.RIGHT)
+        self.btn_step_back = tk.Button(
+            self.frm_toolbar, text="Step Back", command=self.step_back)
+        self.btn_step_back.pack(side=tk.RIGHT)
         self.btn_reset = tk.Button(
             self.frm_toolbar, text="Reset", command=self.reset)
         self.btn_reset.pack(side=tk.RIGHT)
 
+        self.lbl_status = tk.Label(self, anchor=tk.W)
+        self.lbl_status.pack(fill=tk.X, side=tk.BOTTOM)
+        self.refresh_status()
+
         self.txt_code = CodeText(self)
         self.txt_code.pack(fill=tk.BOTH, side=tk.LEFT)
 
@@ -194,25 +226,70 @@ class AVRSimTk(tk.Tk):
             )
 
     def assemble(self):
-        assembler = Assembler(self.txt_code.get("0.0", tk.END))
-        program = assembler.assemble()
+        start, stop = self.assembler.update(self.txt_code.get("0.0", tk.END))
+        if self._unloaded is not None:
+            start = min(start, self._unloaded[0])
+            stop = max(stop, self._unloaded[1])
+        self._unloaded = start, stop
         self.txt_code.tag_error_clear()
-        if assembler.errors:
-            for line_no, err in assembler.errors:
+        errors = self.assembler.errors
+        if errors:
+            for line_no, err in errors:
                 self.txt_code.tag_error(line_no, str(err))
         else:
-            self.machine.load_program(program)
+            self.machine.load_program(self.assembler.program, start, stop)
+            self.machine.journal.clear()
+            self._unloaded = None
             self.frm_flash.refresh()
 
+    def refresh_status(self):
+        cycles = self.machine.cycles
+        frequency = self.machine.clock_frequency
+        self.lbl_status.config(
+            text=f"Cycles: {cycles}  Time: {1e6 * cycles / frequency:.3f} us "
+                 f"at {frequency / 1e6:g} MHz")
+
     def reset(self):
         self.machine.reset()
         self.frm_gpr.refresh()
         self.frm_spr.refresh()
+        self.refresh_status()
+
+    def run(self):
+        breakpoints = set()
+        for line_no in self.txt_code.breakpoints:
+            try:
+                breakpoints.add(self.assembler.address(line_no))
+            except IndexError:
+                pass
+        result = self.machine.run(breakpoints=breakpoints,
+                                  timeout=self.RUN_TIMEOUT)
+        if result.reason is StopReason.HALT:
+            tk.messagebox.showerror(
+                title="Machine halted!",
+                message=f"no instruction at 0x{self.machine.pc:04X}"
+            )
+        self.frm_gpr.refresh()
+        self.frm_spr.refresh()
+        self.refresh_status()
 
     def step(self):
-        self.machine.step()
+        try:
+            self.machine.step()
+        except AVRMachineError as err:
+            tk.messagebox.showerror(
+                title="Machine halted!",
+                message=str(err)
+            )
+        self.frm_gpr.refresh()
+        self.frm_spr.refresh()
+        self.refresh_status()
+
+    def step_back(self):
+        self.machine.step_back()
         self.frm_gpr.refresh()
         self.frm_spr.refresh()
+        self.refresh_status()
 
 
 if __name__ == "__main__":
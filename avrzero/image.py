@@ -0,0 +1,138 @@
+import mmap
+import os
+import sys
+from array import array
+from contextlib import nullcontext
+
+# Intel HEX record types
+DATA = 0x00
+END_OF_FILE = 0x01
+EXTENDED_SEGMENT_ADDRESS = 0x02
+START_SEGMENT_ADDRESS = 0x03
+EXTENDED_LINEAR_ADDRESS = 0x04
+START_LINEAR_ADDRESS = 0x05
+
+
+def _open(file, mode):
+    if isinstance(file, (str, os.PathLike)):
+        return open(file, mode)
+    return nullcontext(file)
+
+
+def _image(flash, stop):
+    """Return the little-endian bytes of the words of flash before ``stop``.
+
+    By default ``stop`` is just past the last word that is not zero.
+    """
+    data = flash.tobytes()
+    if sys.byteorder == "big":
+        words = array("H", data)
+        words.byteswap()
+        data = words.tobytes()
+    if stop is None:
+        stop = -(-len(data.rstrip(b"\0")) // 2)
+    return data[:2 * stop]
+
+
+def load_binary(flash, file, address=0):
+    """Load a raw little-endian binary image into flash at byte ``address``.
+
+    ``file`` is a path, which is mapped with ``mmap``, or a binary file,
+    which is read straight into the flash. Only the words in the image are
+    written. Returns the number of bytes loaded.
+    """
+    if not isinstance(file, (str, os.PathLike)):
+        return flash.readinto(file, address)
+    with open(file, "rb") as image_file:
+        size = os.fstat(image_file.fileno()).st_size
+        if size:
+            with mmap.mmap(image_file.fileno(), 0,
+                           access=mmap.ACCESS_READ) as view:
+                flash.write_bytes(address, view)
+    return size
+
+
+def save_binary(flash, file, stop=None):
+    """Save the words of flash before ``stop`` as a raw binary image."""
+    data = _image(flash, stop)
+    with _open(file, "wb") as image_file:
+        image_file.write(data)
+    return len(data)
+
+
+def load_hex(flash, file):
+    """Load an Intel HEX image into flash.
+
+    Consecutive data records are written to flash in one copy, and only the
+    words they cover are written. Returns the number of bytes loaded.
+    """
+    n_bytes = 0
+    base = 0
+    run_address = 0
+    run = bytearray()
+    with _open(file, "r") as hex_file:
+        for line_no, line in enumerate(hex_file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                if not line.startswith(":"):
+                    raise ValueError("expect ':'")
+                record = bytes.fromhex(line[1:])
+                if len(record) < 5 or len(record) != record[0] + 5:
+                    raise ValueError("invalid record length")
+                if sum(record) & 0xFF:
+                    raise ValueError("invalid checksum")
+            except ValueError as err:
+                raise ValueError(f"line {line_no + 1}: {err}") from None
+            offset = record[1] << 8 | record[2]
+            record_type = record[3]
+            data = record[4:-1]
+            if record_type == DATA:
+                address = base + offset
+                if address != run_address + len(run):
+                    if run:
+                        flash.write_bytes(run_address, run)
+                    run_address = address
+                    run = bytearray()
+                run += data
+                n_bytes += len(data)
+            elif record_type == END_OF_FILE:
+                break
+            elif record_type == EXTENDED_SEGMENT_ADDRESS:
+                base = int.from_bytes(data, "big") << 4
+            elif record_type == EXTENDED_LINEAR_ADDRESS:
+                base = int.from_bytes(data, "big") << 16
+    if run:
+        flash.write_bytes(run_address, run)
+    return n_bytes
+
+
+def _record(record_type, address, data=b""):
+    record = bytes((len(data), address >> 8, address & 0xFF,
+                    record_type)) + data
+    checksum = -sum(record) & 0xFF
+    return ":" + (record + bytes((checksum,))).hex().upper() + "\n"
+
+
+def save_hex(flash, file, stop=None, record_size=16):
+    """Save the words of flash before ``stop`` as an Intel HEX image."""
+    if not 0 < record_size < 256:
+        raise ValueError("invalid record size, expect 1 to 255")
+    data = _image(flash, stop)
+    with _open(file, "w") as hex_file:
+        upper = 0
+        offset = 0
+        while offset < len(data):
+            if offset >> 16 != upper:
+                upper = offset >> 16
+                hex_file.write(_record(EXTENDED_LINEAR_ADDRESS, 0,
+                                       upper.to_bytes(2, "big")))
+            # records do not cross a 64 KiB boundary
+            end = min(offset + record_size, len(data),
+                      (upper + 1) << 16)
+            hex_file.write(_record(DATA, offset & 0xFFFF,
+                                   data[offset:end]))
+            offset = end
+        hex_file.write(_record(END_OF_FILE, 0))
+    return len(data)
@@ -1,10 +1,19 @@
+import hashlib
+import re
 from functools import cache, cached_property
 
+from avrzero import flags
 from avrzero.error import AVRSyntaxError
 
 BYTE_SIZE = 8
 WORD_SIZE = 16
 
+# data memory addresses of special registers
+X_ADDR = 0x1A
+SPL_ADDR = 0x5D
+SPH_ADDR = 0x5E
+SREG_ADDR = 0x5F
+
 
 class Syntax:
 
@@ -25,7 +34,26 @@ class Syntax:
     def name(self):
         return self._tokens[0]
 
+    @cached_property
+    def pattern(self):
+        """The syntax as one regular expression with a group per operand."""
+        regex = ""
+        for token in self._tokens:
+            if isinstance(token, Operand):
+                regex += rf"(?P<{token.name}>\d+)"
+            elif token == " ":
+                regex += r"\s+"
+            else:
+                regex += re.escape(token)
+
+        return re.compile(regex + r"\s*", re.IGNORECASE)
+
     def match(self, string):
+        match = self.pattern.fullmatch(string)
+        if match is not None:
+            return {key: int(val) for key, val in match.groupdict().items()}
+
+        # walk the tokens again to tell where the string went wrong
         operand_map = {}
         for token in self._tokens:
             if isinstance(token, Operand):
@@ -115,6 +143,19 @@ class Operand:
     def choices(self):
         return sorted(tuple(self._choices))
 
+    @cached_property
+    def _indices(self):
+        return {choice: idx for idx, choice in enumerate(self.choices)}
+
+    def index(self, value):
+        if isinstance(self._choices, range):
+            return self._choices.index(value)
+        try:
+            return self._indices[value]
+        except KeyError:
+            raise ValueError(f"{value} is not a choice of {self._name}") \
+                from None
+
     def __str__(self):
         name = self._name
         choices = self._choices
@@ -137,6 +178,10 @@ class Opcode:
                              f"expect multiple of {BYTE_SIZE}")
         self._str = opcode_str
         self._operands = operands
+        self._fields = tuple(
+            (operand.name, operand,
+             self.mask_runs(self.binary_mask(opcode_str, operand.name)))
+            for operand in operands)
 
     def __str__(self):
         return self._str
@@ -145,6 +190,10 @@ class Opcode:
     def n_bits(self):
         return len(self._str)
 
+    @cached_property
+    def n_words(self):
+        return self.n_bits // WORD_SIZE
+
     @cached_property
     def fixed_mask(self):
         return self.binary_mask(self._str, "01")
@@ -159,31 +208,53 @@ class Opcode:
 
     def map_operands(self, operand_map):
         mapped = self.fixed
-        for operand in self._operands:
-            key = operand.name
-            val = operand.choices.index(operand_map[key])
-            mapped |= self.map_int(val, self.mask_char(key))
+        for key, operand, runs in self._fields:
+            idx = operand.index(operand_map[key])
+            for shift, width, dest_shift in runs:
+                mapped |= (idx >> dest_shift & ((1 << width) - 1)) << shift
 
-        codes = []
-        for _ in range(self.n_bits // WORD_SIZE):
-            codes.insert(0, mapped & ((1 << WORD_SIZE) - 1))
-            mapped >>= WORD_SIZE
-        return codes
+        word_mask = (1 << WORD_SIZE) - 1
+        return [mapped >> shift & word_mask
+                for shift in range(self.n_bits - WORD_SIZE, -1, -WORD_SIZE)]
 
     def get_operand_map(self, codes):
         mapped = 0
-        for _ in range(self.n_bits // WORD_SIZE):
-            mapped <<= WORD_SIZE
-            mapped |= codes.pop(0)
+        for code in codes[:self.n_words]:
+            mapped = mapped << WORD_SIZE | code
 
         operand_map = {}
-        for operand in self._operands:
-            key = operand.name
-            idx = self.get_int(mapped, self.mask_char(key))
+        for key, operand, runs in self._fields:
+            idx = 0
+            for shift, width, dest_shift in runs:
+                idx |= (mapped >> shift & ((1 << width) - 1)) << dest_shift
             operand_map[key] = operand.choices[idx]
 
         return operand_map
 
+    @staticmethod
+    def mask_runs(mask):
+        """Split a mask into ``(shift, width, dest_shift)`` runs of bits.
+
+        Each run moves ``width`` bits at ``shift`` of an opcode to
+        ``dest_shift`` of the operand index.
+        """
+        runs = []
+        shift = dest_shift = 0
+        while mask:
+            if mask & 1:
+                width = 0
+                while mask & 1:
+                    mask >>= 1
+                    width += 1
+                runs.append((shift, width, dest_shift))
+                shift += width
+                dest_shift += width
+            else:
+                mask >>= 1
+                shift += 1
+
+        return tuple(runs)
+
     @staticmethod
     def binary_mask(code, select):
         mask = 0
@@ -236,7 +307,8 @@ class Opcode:
 
 class Instruction:
 
-    def __init__(self, action, syntax, operands, opcode):
+    def __init__(self, action, syntax, operands, opcode, branch=False,
+                 cycles=1):
         if not callable(action):
             raise TypeError("invalid type for action, expect callable")
         if not isinstance(syntax, Syntax):
@@ -248,11 +320,18 @@ class Instruction:
                             "expect Operand")
         if not isinstance(opcode, Opcode):
             raise TypeError("invalid type for opcode, expect Opcode")
+        if not isinstance(cycles, int):
+            raise TypeError("invalid type for cycles, expect int")
+        if cycles < 1:
+            raise ValueError("invalid cycles, expect a positive int")
 
         self._action = action
         self._syntax = syntax
         self._operands = operands
         self._opcode = opcode
+        self._branch = bool(branch)
+        self._cycles = cycles
+        self._fast_action = None
 
     def __str__(self):
         return "\n".join((
@@ -265,6 +344,10 @@ class Instruction:
     def action(self):
         return self._action
 
+    @property
+    def fast_action(self):
+        return self._fast_action
+
     @property
     def syntax(self):
         return self._syntax
@@ -277,10 +360,24 @@ class Instruction:
     def opcode(self):
         return self._opcode
 
+    @property
+    def branch(self):
+        return self._branch
+
+    @property
+    def cycles(self):
+        return self._cycles
+
     @cached_property
     def name(self):
         return self.syntax.name
 
+    def fast(self, action):
+        if not callable(action):
+            raise TypeError("invalid type for action, expect callable")
+        self._fast_action = action
+        return self
+
     def str_to_opcode(self, string):
         operand_map = self._syntax.match(string)
         for operand in self._operands:
@@ -290,7 +387,8 @@ class Instruction:
         return self._opcode.map_operands(operand_map)
 
     @classmethod
-    def make(cls, syntax, operands, opcode, belong_to=None):
+    def make(cls, syntax, operands, opcode, belong_to=None, branch=False,
+             cycles=1):
         seen_operand_names = []
         for operand in operands:
             if operand.name in seen_operand_names:
@@ -302,7 +400,8 @@ class Instruction:
             instruction = cls(action,
                               Syntax.parse(syntax, operands),
                               operands,
-                              Opcode.parse(opcode, operands))
+                              Opcode.parse(opcode, operands),
+                              branch, cycles)
             if belong_to is None:
                 InstructionSet.default.add(instruction)
             else:
@@ -321,6 +420,9 @@ class InstructionSet:
             raise TypeError("invalid type for name, expect str")
         self._name = name
         self._instructions = ()
+        self._by_name = {}
+        self._decode_table = None
+        self._fingerprint = None
 
     def __str__(self):
         string = "Instruction Set " + self._name + "\n"
@@ -330,21 +432,82 @@ class InstructionSet:
 
     def add(self, instruction):
         self._instructions = self._instructions + (instruction,)
+        key = instruction.name.casefold()
+        self._by_name[key] = self._by_name.get(key, ()) + (instruction,)
+        self._decode_table = None
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """A hash of what the assembler needs from every instruction."""
+        if self._fingerprint is None:
+            digest = hashlib.sha256()
+            for instruction in self._instructions:
+                operands = ";".join(f"{operand.name}{operand.choices}"
+                                    for operand in instruction.operands)
+                digest.update(f"{instruction.syntax}|{operands}|"
+                              f"{instruction.opcode}\n".encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @property
+    def decode_table(self):
+        """Map every first opcode word to its instruction or None.
+
+        The instruction's ``opcode.n_words`` tells whether a second word
+        follows. Two-word instructions are identified by their first word
+        alone. The table is built on first use and rebuilt after ``add``.
+        """
+        if self._decode_table is None:
+            table = [None] * (1 << WORD_SIZE)
+            # earlier instructions take precedence, so they are written last
+            for instruction in reversed(self._instructions):
+                opcode = instruction.opcode
+                shift = opcode.n_bits - WORD_SIZE
+                fixed_mask = opcode.fixed_mask >> shift
+                fixed = opcode.fixed >> shift
+                free_mask = ~fixed_mask & ((1 << WORD_SIZE) - 1)
+                free = free_mask
+                while True:
+                    table[fixed | free] = instruction
+                    if not free:
+                        break
+                    free = (free - 1) & free_mask
+            self._decode_table = table
+        return self._decode_table
 
     def by_name(self, name):
-        for instruction in self._instructions:
-            if instruction.name.casefold() == name.casefold():
-                yield instruction
+        return self._by_name.get(name.casefold(), ())
+
+    def decode(self, words, pc):
+        """Return the instruction at ``words[pc]`` and its operand map.
+
+        Returns None if no instruction is encoded there, including a
+        two-word instruction cut off by the end of ``words`` and an operand
+        field past the choices of its operand.
+        """
+        if not 0 <= pc < len(words):
+            return None
+        instruction = self.decode_table[words[pc]]
+        if instruction is None:
+            return None
+        opcode = instruction.opcode
+        stop = pc + opcode.n_words
+        if stop > len(words):
+            return None
+        try:
+            operand_map = opcode.get_operand_map(words[pc:stop])
+        except IndexError:
+            return None
+        return instruction, operand_map
 
     def by_opcode(self, codes):
-        opcode = 0
-        for code in codes:
-            opcode <<= WORD_SIZE
-            opcode |= code
-        for instruction in self._instructions:
-            if (instruction.opcode.fixed_mask & opcode ==
-                    instruction.opcode.fixed):
-                return instruction
+        if not codes:
+            return None
+        instruction = self.decode_table[codes[0]]
+        if (instruction is not None
+                and instruction.opcode.n_words == len(codes)):
+            return instruction
 
 
 InstructionSet.default = InstructionSet("default")
@@ -358,20 +521,23 @@ InstructionSet.default = InstructionSet("default")
 )
 def adc(machine, d, r):
     Rd, Rr = machine.R[d], machine.R[r]
-    R = SREG = machine.SREG
+    SREG = machine.SREG
 
-    val = Rd.val + Rr.val + SREG.C
-    SREG.H = Rd[3] and Rr[3] or Rr[3] and not R[3] and not R[3] and Rd[3]
-    SREG.V = Rd[7] and Rr[7] and not R[7] or not Rd[7] and not Rr[7] and R[7]
-    SREG.S = SREG.N != SREG.V
-    SREG.N = R[7]
-    SREG.Z = not R
-    SREG.C = Rd[7] and Rr[7] or Rr[7] and not R[7] or not R[7] and Rd[7]
-    Rd.val = val
+    Rd.val = flags.ADD.apply(SREG, Rd.val, Rr.val, SREG.C)
 
     machine.PC.val += 1
 
 
+@adc.fast
+def adc(machine, d, r):
+    data = machine.memory.data
+    SREG = machine.SREG
+    rd, rr, carry = data[d], data[r], SREG.val & 1
+    data[d] = rd + rr + carry & 0xFF
+    SREG.defer(flags.ADD, carry << 16 | rd << 8 | rr)
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="ADD Rd, Rr",
     operands=(Operand("d", range(0, 32)),
@@ -380,20 +546,21 @@ def adc(machine, d, r):
 )
 def add(machine, d, r):
     Rd, Rr = machine.R[d], machine.R[r]
-    R = SREG = machine.SREG
 
-    val = Rd.val + Rr.val + SREG.C
-    SREG.H = Rd[3] and Rr[3] or Rr[3] and not R[3] and not R[3] and Rd[3]
-    SREG.V = Rd[7] and Rr[7] and not R[7] or not Rd[7] and not Rr[7] and R[7]
-    SREG.S = SREG.N != SREG.V
-    SREG.N = R[7]
-    SREG.Z = not R
-    SREG.C = Rd[7] and Rr[7] or Rr[7] and not R[7] or not R[7] and Rd[7]
-    Rd.val = val
+    Rd.val = flags.ADD.apply(machine.SREG, Rd.val, Rr.val)
 
     machine.PC.val += 1
 
 
+@add.fast
+def add(machine, d, r):
+    data = machine.memory.data
+    rd, rr = data[d], data[r]
+    data[d] = rd + rr & 0xFF
+    machine.SREG.defer(flags.ADD, rd << 8 | rr)
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="BCLR s",
     operands=(Operand("s", range(0, 8)),),
@@ -404,44 +571,108 @@ def bclr(machine, s):
     machine.PC.val += 1
 
 
+@bclr.fast
+def bclr(machine, s):
+    machine.SREG.val &= ~(1 << s)
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="CALL k",
     operands=(Operand("k", range(0, 64_000)),),
     opcode="1001" "010k" "kkkk" "111k"
-           "kkkk" "kkkk" "kkkk" "kkkk"
+           "kkkk" "kkkk" "kkkk" "kkkk",
+    branch=True,
+    cycles=4
 )
 def call(machine, k):
     machine.push_stack(machine.PC.val + 2, 2)
     machine.PC.val = k
 
 
+@call.fast
+def call(machine, k):
+    data = machine.memory.data
+    ret = machine.pc + 2 & 0xFFFF
+    sp = (data[SPH_ADDR] << 8 | data[SPL_ADDR]) - 1 & 0xFFFF
+    data[SPH_ADDR], data[SPL_ADDR] = sp >> 8, sp & 0xFF
+    if sp == SREG_ADDR:
+        machine.SREG.flush()
+    data[sp] = ret & 0xFF
+    sp = (data[SPH_ADDR] << 8 | data[SPL_ADDR]) - 1 & 0xFFFF
+    data[SPH_ADDR], data[SPL_ADDR] = sp >> 8, sp & 0xFF
+    if sp == SREG_ADDR:
+        machine.SREG.flush()
+    data[sp] = ret >> 8
+    machine.pc = k
+
+
 @Instruction.make(
     syntax="LD Rd, X",
     operands=(Operand("d", range(0, 32)),),
-    opcode="1001" "000d" "dddd" "1100"
+    opcode="1001" "000d" "dddd" "1100",
+    cycles=2
 )
 def ld(machine, d):
-    machine.R[d].val = machine.R[machine.X.val].val
+    machine.R[d].val = machine.memory[machine.X.val].val
+    machine.PC.val += 1
+
+
+@ld.fast
+def ld(machine, d):
+    data = machine.memory.data
+    x = data[X_ADDR + 1] << 8 | data[X_ADDR]
+    if x == SREG_ADDR:
+        machine.SREG.flush()
+    data[d] = data[x]
+    machine.pc = machine.pc + 1 & 0xFFFF
 
 
 @Instruction.make(
     syntax="LD Rd, X+",
     operands=(Operand("d", range(0, 32)),),
-    opcode="1001" "000d" "dddd" "1101"
+    opcode="1001" "000d" "dddd" "1101",
+    cycles=2
 )
 def ld_post_inc(machine, d):
-    machine.R[d].val = machine.R[machine.X.val].val
+    machine.R[d].val = machine.memory[machine.X.val].val
     machine.X.val += 1
+    machine.PC.val += 1
+
+
+@ld_post_inc.fast
+def ld_post_inc(machine, d):
+    data = machine.memory.data
+    x = data[X_ADDR + 1] << 8 | data[X_ADDR]
+    if x == SREG_ADDR:
+        machine.SREG.flush()
+    data[d] = data[x]
+    x = (data[X_ADDR + 1] << 8 | data[X_ADDR]) + 1 & 0xFFFF
+    data[X_ADDR + 1], data[X_ADDR] = x >> 8, x & 0xFF
+    machine.pc = machine.pc + 1 & 0xFFFF
 
 
 @Instruction.make(
     syntax="LD Rd, -X",
     operands=(Operand("d", range(0, 32)),),
-    opcode="1001" "000d" "dddd" "1110"
+    opcode="1001" "000d" "dddd" "1110",
+    cycles=3
 )
 def ld_pre_dec(machine, d):
     machine.X.val -= 1
-    machine.R[d].val = machine.R[machine.X.val].val
+    machine.R[d].val = machine.memory[machine.X.val].val
+    machine.PC.val += 1
+
+
+@ld_pre_dec.fast
+def ld_pre_dec(machine, d):
+    data = machine.memory.data
+    x = (data[X_ADDR + 1] << 8 | data[X_ADDR]) - 1 & 0xFFFF
+    data[X_ADDR + 1], data[X_ADDR] = x >> 8, x & 0xFF
+    if x == SREG_ADDR:
+        machine.SREG.flush()
+    data[d] = data[x]
+    machine.pc = machine.pc + 1 & 0xFFFF
 
 
 @Instruction.make(
@@ -455,6 +686,12 @@ def ldi(machine, d, k):
     machine.PC.val += 1
 
 
+@ldi.fast
+def ldi(machine, d, k):
+    machine.memory.data[d] = k
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="NOP",
     operands=(),
@@ -464,30 +701,80 @@ def nop(machine):
     machine.PC.val += 1
 
 
+@nop.fast
+def nop(machine):
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="POP Rd",
     operands=(Operand("d", range(0, 32)),),
-    opcode="1001" "000d" "dddd" "1111"
+    opcode="1001" "000d" "dddd" "1111",
+    cycles=2
 )
 def pop(machine, d):
     machine.R[d].val = machine.pop_stack()
     machine.PC.val += 1
 
 
+@pop.fast
+def pop(machine, d):
+    data = machine.memory.data
+    sp = data[SPH_ADDR] << 8 | data[SPL_ADDR]
+    if sp == SREG_ADDR:
+        machine.SREG.flush()
+    val = data[sp]
+    sp = sp + 1 & 0xFFFF
+    data[SPH_ADDR], data[SPL_ADDR] = sp >> 8, sp & 0xFF
+    data[d] = val
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="PUSH Rd",
     operands=(Operand("d", range(0, 32)),),
-    opcode="1001" "001d" "dddd" "1111"
+    opcode="1001" "001d" "dddd" "1111",
+    cycles=2
 )
 def push(machine, d):
     machine.push_stack(machine.R[d].val)
     machine.PC.val += 1
 
 
+@push.fast
+def push(machine, d):
+    data = machine.memory.data
+    val = data[d]
+    sp = (data[SPH_ADDR] << 8 | data[SPL_ADDR]) - 1 & 0xFFFF
+    data[SPH_ADDR], data[SPL_ADDR] = sp >> 8, sp & 0xFF
+    if sp == SREG_ADDR:
+        machine.SREG.flush()
+    data[sp] = val
+    machine.pc = machine.pc + 1 & 0xFFFF
+
+
 @Instruction.make(
     syntax="RET",
     operands=(),
-    opcode="1001" "0101" "0000" "1000"
+    opcode="1001" "0101" "0000" "1000",
+    branch=True,
+    cycles=4
 )
 def ret(machine):
     machine.PC.val = machine.pop_stack(2)
+
+
+@ret.fast
+def ret(machine):
+    data = machine.memory.data
+    sp = data[SPH_ADDR] << 8 | data[SPL_ADDR]
+    if sp == SREG_ADDR or sp + 1 & 0xFFFF == SREG_ADDR:
+        machine.SREG.flush()
+    high = data[sp]
+    sp = sp + 1 & 0xFFFF
+    data[SPH_ADDR], data[SPL_ADDR] = sp >> 8, sp & 0xFF
+    # the stack pointer may point at itself
+    low = data[sp]
+    sp = sp + 1 & 0xFFFF
+    data[SPH_ADDR], data[SPL_ADDR] = sp >> 8, sp & 0xFF
+    machine.pc = high << 8 | low
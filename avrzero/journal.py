@@ -0,0 +1,80 @@
+from array import array
+
+from avrzero.instruction import SPH_ADDR, SPL_ADDR, SREG_ADDR
+
+
+class UndoJournal:
+    """What the last ``depth`` instructions overwrote, to undo them.
+
+    For every instruction, the journal keeps PC, SP, SREG and the cycle
+    count from before it ran and the address and old value of each byte of
+    data memory it wrote, all in flat arrays. Its memory grows with the
+    bytes written, not with the size of the machine.
+    """
+
+    def __init__(self, machine, depth=1 << 16):
+        if depth <= 0:
+            raise ValueError("invalid depth, expect a positive int")
+        self._machine = machine
+        self._depth = depth
+        # forget old instructions in batches of this many
+        self._slack = max(depth // 8, 1)
+        self._view = memoryview(machine.memory.data)
+        # per instruction
+        self._pcs = array("H")
+        self._sps = array("H")
+        self._sregs = bytearray()
+        self._cycles = array("Q")
+        self._n_writes = array("H")
+        # per byte written
+        self._addrs = array("H")
+        self._olds = bytearray()
+
+    def __len__(self):
+        return min(len(self._pcs), self._depth)
+
+    @property
+    def depth(self):
+        return self._depth
+
+    def clear(self):
+        del self._pcs[:], self._sps[:], self._sregs[:], self._n_writes[:]
+        del self._cycles[:]
+        del self._addrs[:], self._olds[:]
+
+    def begin(self, pc):
+        """Start the entry of the instruction at ``pc``."""
+        view = self._view
+        self._pcs.append(pc)
+        self._sps.append(view[SPH_ADDR] << 8 | view[SPL_ADDR])
+        self._sregs.append(view[SREG_ADDR])
+        self._cycles.append(self._machine.cycles)
+        self._n_writes.append(0)
+        if len(self._pcs) > self._depth + self._slack:
+            self._forget(len(self._pcs) - self._depth)
+
+    def write(self, address, old):
+        """Note that the instruction overwrote ``old`` at ``address``."""
+        self._addrs.append(address)
+        self._olds.append(old)
+        self._n_writes[-1] += 1
+
+    def _forget(self, n_steps):
+        n_bytes = sum(self._n_writes[:n_steps])
+        del self._pcs[:n_steps], self._sps[:n_steps], self._sregs[:n_steps]
+        del self._n_writes[:n_steps], self._cycles[:n_steps]
+        del self._addrs[:n_bytes], self._olds[:n_bytes]
+
+    def undo(self, n_steps=1):
+        """Undo up to ``n_steps`` instructions and return how many were."""
+        view = self._view
+        n_steps = max(min(n_steps, len(self)), 0)
+        for _ in range(n_steps):
+            for _ in range(self._n_writes.pop()):
+                view[self._addrs.pop()] = self._olds.pop()
+            sp = self._sps.pop()
+            view[SPH_ADDR], view[SPL_ADDR] = sp >> 8, sp & 0xFF
+            view[SREG_ADDR] = self._sregs.pop()
+            self._machine.cycles = self._cycles.pop()
+            self._machine.pc = self._pcs.pop()
+        return n_steps
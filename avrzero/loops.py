@@ -0,0 +1,38 @@
+class LoopDetector:
+    """Tell when a machine is back in a state it has been in before.
+
+    Uses Brent's cycle detection over the states at which ``check`` is
+    called: the PC and data memory are saved at the 1st, 2nd, 4th, 8th...
+    check, and every check compares against the saved state, the PC first
+    and all of the data memory in one C-level comparison only if the PC
+    matches. As the machine is deterministic, a state seen twice repeats
+    forever, and a loop is found within a few times its length. Nothing
+    is done per write, and only one state is kept.
+    """
+
+    def __init__(self, machine):
+        self._data = machine.memory.data
+        self._sreg = machine.SREG
+        self.clear()
+
+    def clear(self):
+        """Forget the saved state, for memory that may have been replaced."""
+        self._pc = None
+        self._saved = None
+        self._n_checks = 0
+        self._period = 1
+
+    def check(self, pc):
+        """Return whether the state at ``pc`` repeats the saved state."""
+        if pc == self._pc:
+            self._sreg.flush()
+            if self._data == self._saved:
+                return True
+        self._n_checks += 1
+        if self._n_checks == self._period:
+            self._sreg.flush()
+            self._pc = pc
+            self._saved = bytes(self._data)
+            self._n_checks = 0
+            self._period *= 2
+        return False
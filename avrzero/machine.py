@@ -1,15 +1,65 @@
+from collections import namedtuple
+from enum import Enum
+from functools import partial
+from math import inf
+from time import perf_counter, perf_counter_ns
+
+from avrzero.callgraph import CallGraph
+from avrzero.coverage import Coverage
 from avrzero.error import AVRMachineError
 from avrzero.instruction import BYTE_SIZE, InstructionSet
-from avrzero.register import Register, PointerRegister, StatusRegister
+from avrzero.journal import UndoJournal
+from avrzero.loops import LoopDetector
+from avrzero.memory import (WATCH_OLD, WATCH_READ, WATCH_WRITE, DataMemory,
+                            Flash, MemoryBuffer, WatchedMemoryBuffer)
+from avrzero.profiler import Profiler
+from avrzero.register import (AttributeRegister, PointerRegister, Register,
+                              StatusRegister)
+from avrzero.trace import TraceRecorder
+from avrzero.translator import BlockTranslator
+
+
+class StopReason(Enum):
+    MAX_STEPS = "max steps"
+    UNTIL_PC = "until pc"
+    BREAKPOINT = "breakpoint"
+    TIMEOUT = "timeout"
+    MAX_CYCLES = "max cycles"
+    WATCHPOINT = "watchpoint"
+    NON_TERMINATING = "non-terminating"
+    HALT = "halt"
+
+
+RunResult = namedtuple("RunResult", ("reason", "steps", "elapsed", "cycles"))
+
+Snapshot = namedtuple("Snapshot",
+                      ("memory", "flash", "pc", "sp", "sreg", "cycles"))
+
+Watchpoint = namedtuple("Watchpoint", ("start", "stop", "read", "write"))
+
+WatchHit = namedtuple("WatchHit", ("pc", "address", "access", "val"))
 
 
 class Machine:
+    ENGINES = ("interpreter", "block")
+    # steps between two clock reads when a timeout is given
+    TIMEOUT_CHECK_STEPS = 1 << 10
+    # granularity in bytes at which restore compares and copies memory
+    SNAPSHOT_PAGE_SIZE = 1 << 8
+    # instructions kept by the trace recorder
+    TRACE_DEPTH = 1 << 16
+    # instructions that step_back can undo
+    UNDO_DEPTH = 1 << 16
+    # calls and returns kept by the call graph for trace export
+    CALL_GRAPH_EVENTS = 1 << 20
 
     def __init__(self, RAMEND=0xFFFF, flash_size=0x10000,
-                 instruction_set=InstructionSet.default):
+                 instruction_set=InstructionSet.default,
+                 engine="interpreter", lazy_flags=False,
+                 clock_frequency=16_000_000):
         # === Data Memory ===
         self.RAMEND = RAMEND
-        self.memory = [Register(addr=addr) for addr in range(RAMEND + 1)]
+        self.memory = DataMemory(RAMEND + 1)
 
         # general purpose registers
         self.R = self.general_registers = self.memory[0x00:0x20]
@@ -17,23 +67,65 @@ class Machine:
         self.Y = PointerRegister("Y", self.memory[29:27:-1])
         self.Z = PointerRegister("Z", self.memory[31:29:-1])
 
-        # I/O registers
+        # I/O registers, with SREG bound first so that every view of 0x5F
+        # is the status register itself
+        self.SREG = StatusRegister.from_(self.memory[0x5F])
+        self.SREG.lazy = lazy_flags
+        self.memory.bind(self.SREG)
         self.IOR = self.io_registers = self.memory[0x20:0x60]
         self.SP = PointerRegister("stack pointer", self.memory[0x5E:0x5C:-1])
-        self.SREG = StatusRegister.from_(self.memory[0x5F])
 
         # extended I/O registers
         self.EIOR = self.ext_io_registers = self.memory[0x0060:0x0100]
 
         # === Program Memory ===
         self.flash_size = flash_size
-        self.flash = [0x00] * flash_size
+        self.flash = Flash(flash_size)
+        self.flash.add_listener(self._invalidate_decoded)
+
+        self.pc = 0x0000
+        self.PC = AttributeRegister("program counter", self, "pc")
 
-        self.PC = PointerRegister("program counter", (Register(), Register()))
+        # === Timing ===
+        if clock_frequency <= 0:
+            raise ValueError("invalid clock frequency, expect a positive "
+                             "number of Hz")
+        self.clock_frequency = clock_frequency
+        self.cycles = 0
 
         # === Instruction Set ===
         self.instruction_set = instruction_set
 
+        # === Predecode Cache ===
+        self._decoded = {}
+        self.decode_hits = 0
+        self.decode_misses = 0
+
+        # === Execution Engine ===
+        self.engine = engine
+        self.translator = BlockTranslator(self)
+
+        # === Debugging ===
+        self.tracer = None
+        self._tracing = False
+        self.breakpoints = set()
+        self._watchpoints = []
+        self._watch_hits = []
+        self.journal = None
+        self._journaling = False
+        self.profiler = None
+        self._profiling = False
+        self.call_graph = None
+        self._call_graphing = False
+        self.coverage = None
+        self._covering = False
+        self.loop_detector = None
+        self._detecting_loops = False
+        self._instrumented = False
+        # address of the instruction executing while instrumented
+        self._current_pc = None
+        self._watch_lazy_flags = lazy_flags
+
         # === Reset ===
         self.reset()
 
@@ -41,7 +133,9 @@ class Machine:
         return "\n".join((
             f"Machine(RAMEND={self.RAMEND},",
             f"        flash_size={self.flash_size},",
-            f"        instruction_set={self.instruction_set!r})"))
+            f"        instruction_set={self.instruction_set!r},",
+            f"        engine={self.engine!r},",
+            f"        lazy_flags={self.SREG.lazy!r})"))
 
     def __str__(self):
         lines = ["=" * 80]
@@ -53,6 +147,17 @@ class Machine:
         lines.append("=" * 80)
         return "\n".join(lines)
 
+    @property
+    def engine(self):
+        return self._engine
+
+    @engine.setter
+    def engine(self, engine):
+        if engine not in self.ENGINES:
+            raise ValueError(f"invalid engine {engine!r}, "
+                             f"expect one of {self.ENGINES}")
+        self._engine = engine
+
     def _push_stack(self, val):
         self.SP.val -= 1
         self.memory[self.SP.val].val = val
@@ -78,19 +183,505 @@ class Machine:
     def reset(self):
         self.SP.val = self.RAMEND
         self.PC.val = 0x0000
+        self.cycles = 0
+        if self.journal is not None:
+            self.journal.clear()
 
-    def load_program(self, program):
-        self.flash[:] = [0x00] * len(self.flash)
-        program = program[:len(self.flash)]
-        self.flash[:len(program)] = program
+    def load_program(self, program, start=0, stop=None):
+        """Write ``program`` to flash, see ``Flash.load``."""
+        self.flash.load(program, start, stop)
 
-    def step(self):
-        opcode = self.flash[self.PC.val:self.PC.val + 1]
-        instruction = self.instruction_set.by_opcode(opcode)
-        if instruction is None:
-            opcode = self.flash[self.PC.val:self.PC.val + 2]
-            instruction = self.instruction_set.by_opcode(opcode)
-        if instruction is None:
+    def snapshot(self):
+        self.SREG.flush()
+        return Snapshot(self.memory.tobytes(), self.flash.tobytes(),
+                        self.pc, self.SP.val, self.SREG.val, self.cycles)
+
+    def restore(self, snapshot):
+        """Restore a snapshot and return the number of bytes copied.
+
+        Only pages that differ from the snapshot are copied.
+        """
+        if (len(snapshot.memory) != len(self.memory)
+                or len(snapshot.flash) != 2 * len(self.flash)):
+            raise ValueError("snapshot of a machine of another size")
+        page = self.SNAPSHOT_PAGE_SIZE
+        self.SREG.flush()
+        copied = self.memory.restore(snapshot.memory, page)
+        copied += self.flash.restore(snapshot.flash, page)
+        self.SREG.val = snapshot.sreg
+        self.SP.val = snapshot.sp
+        self.pc = snapshot.pc
+        self.cycles = snapshot.cycles
+        return copied
+
+    @property
+    def watchpoints(self):
+        return tuple(self._watchpoints)
+
+    @property
+    def watch_hits(self):
+        """The watched accesses of the last instruction executed."""
+        return tuple(self._watch_hits)
+
+    def watch(self, target, stop=None, read=False, write=True):
+        """Stop execution when watched data memory is read or written.
+
+        ``target`` is an address, or the start of a range up to ``stop``,
+        a ``range``, or a register on data memory such as ``X`` or ``SP``.
+        """
+        if isinstance(target, Register):
+            addrs = target.addr
+            if addrs is None:
+                raise ValueError(f"{target.name} is not on data memory")
+            if isinstance(addrs, int):
+                addrs = (addrs,)
+            start, stop = min(addrs), max(addrs) + 1
+        elif isinstance(target, range):
+            if target.step != 1:
+                raise ValueError("invalid step for range, expect 1")
+            start, stop = target.start, target.stop
+        else:
+            start = target
+            stop = start + 1 if stop is None else stop
+        if not 0 <= start < stop <= len(self.memory):
+            raise ValueError(f"invalid watch range {start:#x}:{stop:#x}")
+        if not (read or write):
+            raise ValueError("watch reads, writes or both")
+        watchpoint = Watchpoint(start, stop, bool(read), bool(write))
+        self._watchpoints.append(watchpoint)
+        self._arm_memory()
+        return watchpoint
+
+    def unwatch(self, watchpoint):
+        self._watchpoints.remove(watchpoint)
+        self._arm_memory()
+
+    def _arm_memory(self):
+        """Swap the watched memory buffer in or out.
+
+        Without watchpoints and journal the memory is a plain
+        ``MemoryBuffer`` and ``step`` and ``run`` execute exactly as if
+        neither existed.
+        """
+        data = self.memory.data
+        if not isinstance(data, MemoryBuffer):
+            raise TypeError("memory does not support watchpoints")
+        if not (self._watchpoints or self._journaling):
+            if isinstance(data, WatchedMemoryBuffer):
+                data.__class__ = MemoryBuffer
+                self.SREG.lazy = self._watch_lazy_flags
+            self._instrument()
+            return
+
+        mask = bytearray(len(data))
+        if self._journaling:
+            mask[:] = bytes((WATCH_OLD,)) * len(data)
+        for start, stop, read, write in self._watchpoints:
+            bits = read * WATCH_READ | write * WATCH_WRITE
+            for addr in range(start, stop):
+                mask[addr] |= bits
+        if isinstance(data, WatchedMemoryBuffer):
+            type(data).mask = mask
+            self._instrument()
             return
-        operand_map = instruction.opcode.get_operand_map(opcode)
-        instruction.action(self, **operand_map)
+
+        hits = self._watch_hits
+
+        def record(address, access, val):
+            if self._current_pc is None:
+                return
+            if access == WATCH_OLD:
+                self.journal.write(address, val)
+                return
+            access = "read" if access == WATCH_READ else "write"
+            hits.append(WatchHit(self._current_pc, address, access, val))
+
+        # pending flags would be written by a later instruction
+        self._watch_lazy_flags = self.SREG.lazy
+        self.SREG.lazy = False
+        data.__class__ = type("MachineWatchedMemoryBuffer",
+                              (WatchedMemoryBuffer,),
+                              {"__slots__": (), "mask": mask,
+                               "record": staticmethod(record)})
+        self._instrument()
+
+    def start_trace(self, depth=None):
+        """Record the instructions executed from now on.
+
+        Keeps the current ``tracer`` unless a different ``depth`` is asked
+        for. Returns the ``TraceRecorder``.
+        """
+        if self.tracer is None or (depth is not None
+                                   and depth != self.tracer.depth):
+            self.tracer = TraceRecorder(self, depth or self.TRACE_DEPTH)
+        self._tracing = True
+        self._instrument()
+        return self.tracer
+
+    def stop_trace(self):
+        """Stop recording, keeping what was recorded in ``tracer``."""
+        if self._tracing:
+            self.tracer.end()
+        self._tracing = False
+        self._instrument()
+
+    def start_journal(self, depth=None):
+        """Journal the instructions executed from now on for ``step_back``.
+
+        Returns the ``UndoJournal``.
+        """
+        if self.journal is None or (depth is not None
+                                    and depth != self.journal.depth):
+            self.journal = UndoJournal(self, depth or self.UNDO_DEPTH)
+        self._journaling = True
+        self._arm_memory()
+        return self.journal
+
+    def stop_journal(self):
+        """Stop journaling and forget what can be undone."""
+        self._journaling = False
+        if self.journal is not None:
+            self.journal.clear()
+        self._arm_memory()
+
+    def step_back(self, n_steps=1):
+        """Undo the last ``n_steps`` instructions and return how many were.
+
+        Only instructions executed while the journal was on can be undone.
+        """
+        if self.journal is None:
+            return 0
+        return self.journal.undo(n_steps)
+
+    def start_profile(self):
+        """Count the instructions executed from now on.
+
+        Keeps adding to the current ``profiler``. Returns the ``Profiler``.
+        """
+        if self.profiler is None:
+            self.profiler = Profiler(self)
+        self._profiling = True
+        self._instrument()
+        return self.profiler
+
+    def stop_profile(self):
+        """Stop counting, keeping the counts in ``profiler``."""
+        self._profiling = False
+        self._instrument()
+
+    def start_call_graph(self, max_events=None):
+        """Track the subroutines called from now on.
+
+        Keeps adding to the current ``call_graph`` unless a different
+        ``max_events`` is asked for. Returns the ``CallGraph``.
+        """
+        if self.call_graph is None or (
+                max_events is not None
+                and max_events != self.call_graph.max_events):
+            self.call_graph = CallGraph(
+                self, self.CALL_GRAPH_EVENTS if max_events is None
+                else max_events)
+        self._call_graphing = True
+        self._instrument()
+        return self.call_graph
+
+    def stop_call_graph(self):
+        """Stop tracking, keeping what was tracked in ``call_graph``."""
+        self._call_graphing = False
+        self._instrument()
+
+    def start_coverage(self):
+        """Mark the addresses executed from now on in ``coverage``.
+
+        Keeps adding to the current ``coverage``. Returns the ``Coverage``.
+        """
+        if self.coverage is None:
+            self.coverage = Coverage(len(self.flash))
+        self._covering = True
+        self._instrument()
+        return self.coverage
+
+    def stop_coverage(self):
+        """Stop marking, keeping the marks in ``coverage``."""
+        self._covering = False
+        self._instrument()
+
+    def start_loop_detection(self):
+        """Stop ``run`` when the machine state repeats.
+
+        The state is checked whenever the PC moves backwards, and ``run``
+        returns ``StopReason.NON_TERMINATING`` once a state seen earlier in
+        the same run comes back. Returns the ``LoopDetector``.
+        """
+        if self.loop_detector is None:
+            self.loop_detector = LoopDetector(self)
+        self._detecting_loops = True
+        self._instrument()
+        return self.loop_detector
+
+    def stop_loop_detection(self):
+        """Stop detecting loops."""
+        self._detecting_loops = False
+        self._instrument()
+
+    def _instrument(self):
+        """Shadow ``step`` with the instrumented one while it is needed."""
+        self._instrumented = bool(self._watchpoints or self._tracing
+                                  or self._journaling or self._profiling
+                                  or self._call_graphing or self._covering
+                                  or self._detecting_loops)
+        if self._instrumented:
+            self.step = self._step_instrumented
+        else:
+            vars(self).pop("step", None)
+
+    def action_for(self, instruction):
+        """Pick the fast action if the memory exposes its raw bytes."""
+        if (instruction.fast_action is not None
+                and isinstance(getattr(self.memory, "data", None),
+                               bytearray)):
+            return instruction.fast_action
+        return instruction.action
+
+    def _decode(self, pc):
+        decoded = self.instruction_set.decode(self.flash, pc)
+        if decoded is None:
+            return None
+        instruction, operand_map = decoded
+        entry = (instruction,
+                 partial(self.action_for(instruction), **operand_map),
+                 instruction.cycles)
+        self._decoded[pc] = entry
+        return entry
+
+    def _invalidate_decoded(self, start, stop):
+        # a two-word instruction at start - 1 also covers start
+        start = max(start - 1, 0)
+        if stop - start < len(self._decoded):
+            for pc in range(start, stop):
+                self._decoded.pop(pc, None)
+        else:
+            # mutate in place, run() holds on to the dictionary
+            for pc in [pc for pc in self._decoded if start <= pc < stop]:
+                del self._decoded[pc]
+
+    def step(self):
+        pc = self.pc
+        entry = self._decoded.get(pc)
+        if entry is None:
+            self.decode_misses += 1
+            entry = self._decode(pc)
+            if entry is None:
+                raise AVRMachineError(f"no instruction at 0x{pc:04X}")
+        else:
+            self.decode_hits += 1
+        instruction, action, cycles = entry
+        action(self)
+        self.cycles += cycles
+
+    def _step_observed(self):
+        pc = self.pc
+        entry = self._decoded.get(pc)
+        if entry is None:
+            self.decode_misses += 1
+            entry = self._decode(pc)
+            if entry is None:
+                raise AVRMachineError(f"no instruction at 0x{pc:04X}")
+        else:
+            self.decode_hits += 1
+        instruction, action, cycles = entry
+        if self._profiling:
+            start = perf_counter_ns()
+            action(self)
+            self.profiler.record(pc, instruction, perf_counter_ns() - start)
+        else:
+            action(self)
+        self.cycles += cycles
+        if self._call_graphing:
+            self.call_graph.record(instruction, cycles)
+
+    def _step_instrumented(self):
+        del self._watch_hits[:]
+        pc = self._current_pc = self.pc
+        if self._tracing and pc < len(self.flash):
+            self.tracer.record(pc)
+        if self._journaling:
+            self.journal.begin(pc)
+        try:
+            if self._profiling or self._call_graphing:
+                Machine._step_observed(self)
+            else:
+                Machine.step(self)
+        except AVRMachineError:
+            if self._journaling:
+                # the instruction did not execute
+                self.journal.undo()
+            if self._tracing:
+                self.tracer.end()
+            raise
+        else:
+            if self._covering:
+                self.coverage.mark(pc)
+        finally:
+            self._current_pc = None
+
+    def run(self, max_steps=None, until_pc=None, breakpoints=(),
+            timeout=None, max_cycles=None):
+        """Execute instructions until a stop condition is met.
+
+        Stops before executing the instruction at ``until_pc`` or at any
+        address in ``breakpoints`` or ``self.breakpoints``, except that a
+        breakpoint at the starting address is stepped over. Also stops
+        after ``max_steps`` instructions, once ``max_cycles`` cycles have
+        been spent, once ``timeout`` seconds have elapsed, after an
+        instruction that accessed a watchpoint, or on an address that does
+        not decode to an instruction.
+        """
+        start = perf_counter()
+        deadline = None if timeout is None else start + timeout
+        breakpoints = frozenset(breakpoints) | self.breakpoints
+        start_cycles = self.cycles
+        stop_cycles = inf if max_cycles is None else start_cycles + max_cycles
+        if self.pc == until_pc:
+            reason, steps = StopReason.UNTIL_PC, 0
+        elif self._instrumented:
+            reason, steps = self._run_instrumented(
+                max_steps, until_pc, breakpoints, deadline, stop_cycles)
+        elif self._engine == "block":
+            reason, steps = self._run_blocks(
+                max_steps, until_pc, breakpoints, deadline, stop_cycles)
+        else:
+            reason, steps = self._run_interpreter(
+                max_steps, until_pc, breakpoints, deadline, stop_cycles)
+
+        return RunResult(reason, steps, perf_counter() - start,
+                         self.cycles - start_cycles)
+
+    def _run_interpreter(self, max_steps, until_pc, breakpoints, deadline,
+                         stop_cycles):
+        check_mask = self.TIMEOUT_CHECK_STEPS - 1
+        decoded = self._decoded
+        decode = self._decode
+        steps = misses = 0
+        cycles = self.cycles
+        pc = self.pc
+        try:
+            while True:
+                if steps == max_steps:
+                    return StopReason.MAX_STEPS, steps
+                if cycles >= stop_cycles:
+                    return StopReason.MAX_CYCLES, steps
+                if (deadline is not None and not steps & check_mask
+                        and perf_counter() >= deadline):
+                    return StopReason.TIMEOUT, steps
+                entry = decoded.get(pc)
+                if entry is None:
+                    entry = decode(pc)
+                    if entry is None:
+                        self.decode_misses += 1
+                        return StopReason.HALT, steps
+                    misses += 1
+                entry[1](self)
+                cycles += entry[2]
+                steps += 1
+                pc = self.pc
+                if pc == until_pc:
+                    return StopReason.UNTIL_PC, steps
+                if pc in breakpoints:
+                    return StopReason.BREAKPOINT, steps
+        finally:
+            self.cycles = cycles
+            self.decode_hits += steps - misses
+            self.decode_misses += misses
+
+    def _run_instrumented(self, max_steps, until_pc, breakpoints,
+                          deadline, stop_cycles):
+        check_mask = self.TIMEOUT_CHECK_STEPS - 1
+        hits = self._watch_hits
+        record = self.tracer.record if self._tracing else None
+        begin = self.journal.begin if self._journaling else None
+        covered = self.coverage.bits if self._covering else None
+        check = None
+        if self._detecting_loops:
+            # the state may have been changed between runs
+            self.loop_detector.clear()
+            check = self.loop_detector.check
+        n_words = len(self.flash)
+        step = Machine._step_observed \
+            if self._profiling or self._call_graphing else Machine.step
+        steps = 0
+        del hits[:]
+        try:
+            while True:
+                if steps == max_steps:
+                    return StopReason.MAX_STEPS, steps
+                if self.cycles >= stop_cycles:
+                    return StopReason.MAX_CYCLES, steps
+                if (deadline is not None and not steps & check_mask
+                        and perf_counter() >= deadline):
+                    return StopReason.TIMEOUT, steps
+                pc = self._current_pc = self.pc
+                if record is not None and pc < n_words:
+                    record(pc)
+                if begin is not None:
+                    begin(pc)
+                try:
+                    step(self)
+                except AVRMachineError:
+                    if begin is not None:
+                        self.journal.undo()
+                    if record is not None:
+                        self.tracer.end()
+                    return StopReason.HALT, steps
+                if covered is not None:
+                    covered[pc >> 3] |= 1 << (pc & 7)
+                steps += 1
+                if hits:
+                    return StopReason.WATCHPOINT, steps
+                if check is not None and self.pc <= pc and check(self.pc):
+                    return StopReason.NON_TERMINATING, steps
+                pc = self.pc
+                if pc == until_pc:
+                    return StopReason.UNTIL_PC, steps
+                if pc in breakpoints:
+                    return StopReason.BREAKPOINT, steps
+        finally:
+            self._current_pc = None
+
+    def _run_blocks(self, max_steps, until_pc, breakpoints, deadline,
+                    stop_cycles):
+        check_mask = self.TIMEOUT_CHECK_STEPS - 1
+        stop_pcs = breakpoints | {until_pc}
+        get_block = self.translator.block
+        step = self.step
+        steps = n_blocks = 0
+        pc = self.pc
+        while True:
+            if steps == max_steps:
+                return StopReason.MAX_STEPS, steps
+            if self.cycles >= stop_cycles:
+                return StopReason.MAX_CYCLES, steps
+            if (deadline is not None and not n_blocks & check_mask
+                    and perf_counter() >= deadline):
+                return StopReason.TIMEOUT, steps
+            block = get_block(pc)
+            if block is None:
+                self.decode_misses += 1
+                return StopReason.HALT, steps
+            if ((max_steps is not None
+                    and steps + block.n_steps > max_steps)
+                    or self.cycles + block.n_cycles > stop_cycles
+                    or not stop_pcs.isdisjoint(block.inner)):
+                # the block would run past a stop condition
+                step()
+                steps += 1
+            else:
+                block.function(self)
+                steps += block.n_steps
+                self.cycles += block.n_cycles
+            n_blocks += 1
+            pc = self.pc
+            if pc == until_pc:
+                return StopReason.UNTIL_PC, steps
+            if pc in breakpoints:
+                return StopReason.BREAKPOINT, steps
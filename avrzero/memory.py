@@ -0,0 +1,268 @@
+import sys
+from array import array
+from random import getrandbits
+
+from avrzero.instruction import BYTE_SIZE
+from avrzero.register import Register
+
+
+# access kinds of a watchpoint, as bits of the watch mask
+WATCH_READ = 1
+WATCH_WRITE = 2
+# the value a write is about to overwrite, for the undo journal
+WATCH_OLD = 4
+
+
+class MemoryBuffer(bytearray):
+    """The bytes of a data memory.
+
+    Indexing is as fast as a plain ``bytearray``. While watchpoints or the
+    undo journal are armed, the instance is switched to a
+    ``WatchedMemoryBuffer`` subclass.
+    """
+    __slots__ = ()
+
+
+class WatchedMemoryBuffer(MemoryBuffer):
+    """A memory buffer that records integer-indexed accesses.
+
+    Subclasses set ``mask``, a ``bytearray`` of ``WATCH_READ``,
+    ``WATCH_WRITE`` and ``WATCH_OLD`` bits per address, and
+    ``record(address, access, val)``. Slice accesses are not watched.
+    """
+    __slots__ = ()
+    mask = None
+
+    @staticmethod
+    def record(address, access, val):
+        raise NotImplementedError
+
+    def __getitem__(self, key):
+        val = super().__getitem__(key)
+        if type(key) is int and self.mask[key] & WATCH_READ:
+            self.record(key % len(self), WATCH_READ, val)
+        return val
+
+    def __setitem__(self, key, val):
+        if type(key) is not int:
+            super().__setitem__(key, val)
+            return
+        bits = self.mask[key]
+        if bits & WATCH_OLD:
+            old = super().__getitem__(key)
+            super().__setitem__(key, val)
+            self.record(key % len(self), WATCH_OLD, old)
+        else:
+            super().__setitem__(key, val)
+        if bits & WATCH_WRITE:
+            self.record(key % len(self), WATCH_WRITE, val)
+
+
+class DataMemory:
+
+    def __init__(self, size, data=None):
+        if data is None:
+            data = MemoryBuffer(
+                getrandbits(size * BYTE_SIZE).to_bytes(size, "little"))
+        if len(data) != size:
+            raise ValueError(f"invalid length for data, expect {size}")
+        self._data = data
+        self._bound = {}
+
+    def __repr__(self):
+        return f"DataMemory(size={len(self)})"
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    def __getitem__(self, key):
+        addrs = range(len(self._data))[key]
+        if isinstance(addrs, range):
+            return [self._view(addr) for addr in addrs]
+        return self._view(addrs)
+
+    def _view(self, addr):
+        register = self._bound.get(addr)
+        if register is None:
+            register = Register(addr=addr, data=self._data)
+        return register
+
+    @property
+    def data(self):
+        return self._data
+
+    def bind(self, register):
+        """Return ``register`` itself when indexing its address."""
+        self._bound[register.addr] = register
+
+    def tobytes(self):
+        return bytes(self._data)
+
+    def restore(self, snapshot, page):
+        """Copy back the pages that differ from ``snapshot``.
+
+        Returns the number of bytes copied.
+        """
+        copied = 0
+        view = memoryview(self._data)
+        for start, stop in changed_pages(view, snapshot, page):
+            self._data[start:stop] = snapshot[start:stop]
+            copied += stop - start
+        return copied
+
+
+class Flash:
+
+    def __init__(self, size):
+        self._words = array("H", bytes(2 * size))
+        self._listeners = []
+
+    def __repr__(self):
+        return f"Flash(size={len(self)})"
+
+    def __len__(self):
+        return len(self._words)
+
+    def __iter__(self):
+        return iter(self._words)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self._words[key].tolist()
+        return self._words[key]
+
+    def __setitem__(self, key, val):
+        addrs = range(len(self._words))[key]
+        if isinstance(addrs, range):
+            val = array("H", val)
+            if len(val) != len(addrs):
+                raise ValueError("flash cannot be resized")
+            if not addrs:
+                return
+            start, stop = min(addrs), max(addrs) + 1
+        else:
+            start, stop = addrs, addrs + 1
+        self._words[key] = val
+        self._notify(start, stop)
+
+    def load(self, program, start=0, stop=None):
+        """Write ``program`` from word 0, clearing the words past its end.
+
+        Only the words from ``start`` to ``stop`` are written, so a caller
+        that knows which part of a program changed can skip the rest.
+        """
+        stop = len(self._words) if stop is None \
+            else min(stop, len(self._words))
+        if start >= stop:
+            return
+        words = array("H", program[start:stop])
+        words.frombytes(bytes(words.itemsize * (stop - start - len(words))))
+        self[start:stop] = words
+
+    def add_listener(self, listener):
+        """Call ``listener(start, stop)`` after every write to flash."""
+        self._listeners.append(listener)
+
+    def tobytes(self):
+        return self._words.tobytes()
+
+    def view(self):
+        """Return a read-only ``memoryview`` of the words."""
+        return memoryview(self._words).toreadonly()
+
+    def _notify(self, start, stop):
+        for listener in self._listeners:
+            listener(start, stop)
+
+    def write_bytes(self, address, data):
+        """Write the little-endian bytes ``data`` from byte ``address``.
+
+        Only the words that ``data`` covers are written, in one copy.
+        """
+        stop_address = address + len(data)
+        if address < 0 or stop_address > len(self._words) * 2:
+            raise ValueError("image does not fit in flash")
+        start, stop = address // 2, -(-stop_address // 2)
+        if start == stop:
+            return
+        if sys.byteorder == "little":
+            with memoryview(self._words).cast("B") as view:
+                view[address:stop_address] = data
+        else:
+            words = self._words[start:stop]
+            words.byteswap()
+            with memoryview(words).cast("B") as view:
+                view[address - 2 * start:stop_address - 2 * start] = data
+            words.byteswap()
+            self._words[start:stop] = words
+        self._notify(start, stop)
+
+    def readinto(self, file, address=0):
+        """Read a little-endian binary file into flash from byte ``address``.
+
+        The file is read straight into the flash buffer. Like
+        ``write_bytes``, an image of an odd length leaves the high byte of
+        its last word alone. Returns the number of bytes read.
+        """
+        size = len(self._words) * 2
+        if address % 2:
+            raise ValueError("invalid address, expect a word boundary")
+        if not 0 <= address <= size:
+            raise ValueError("image does not fit in flash")
+        stop_address = address
+        if sys.byteorder == "big":
+            # read little-endian bytes over little-endian words
+            self._words.byteswap()
+        try:
+            with memoryview(self._words).cast("B") as view:
+                while stop_address < size:
+                    n_bytes = file.readinto(view[stop_address:])
+                    if not n_bytes:
+                        break
+                    stop_address += n_bytes
+        finally:
+            if sys.byteorder == "big":
+                self._words.byteswap()
+        start, stop = address // 2, -(-stop_address // 2)
+        if start < stop:
+            self._notify(start, stop)
+        if stop_address == size and file.read(1):
+            raise ValueError("image does not fit in flash")
+        return stop_address - address
+
+    def restore(self, snapshot, page):
+        """Copy back the pages that differ from ``snapshot``.
+
+        Returns the number of bytes copied.
+        """
+        copied = 0
+        view = memoryview(self._words).cast("B")
+        source = memoryview(snapshot).cast("H")
+        for start, stop in changed_pages(view, snapshot, page):
+            start //= self._words.itemsize
+            stop //= self._words.itemsize
+            self[start:stop] = source[start:stop]
+            copied += (stop - start) * self._words.itemsize
+        return copied
+
+
+def changed_pages(view, snapshot, page, start=0, stop=None):
+    """Yield the ``(start, stop)`` byte ranges of pages that differ.
+
+    Halves are compared recursively, so unchanged regions cost one
+    comparison each, however large they are.
+    """
+    if stop is None:
+        stop = len(snapshot)
+    if view[start:stop].tobytes() == snapshot[start:stop]:
+        return
+    n_pages = -(-(stop - start) // page)
+    if n_pages == 1:
+        yield start, stop
+        return
+    mid = start + n_pages // 2 * page
+    yield from changed_pages(view, snapshot, page, start, mid)
+    yield from changed_pages(view, snapshot, page, mid, stop)
@@ -0,0 +1,89 @@
+from array import array
+from collections import namedtuple
+
+InstructionProfile = namedtuple("InstructionProfile",
+                                ("instruction", "count", "seconds"))
+
+
+class Profiler:
+    """How often each address and instruction of a machine executed.
+
+    Hit counts per flash address are kept in a flat array, and the count
+    and the host time spent in the action of each ``Instruction`` in a
+    dict keyed by the instruction.
+    """
+
+    def __init__(self, machine):
+        self._machine = machine
+        self._counts = array("Q", bytes(8 * len(machine.flash)))
+        # instruction -> [count, nanoseconds]
+        self._instructions = {}
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def total(self):
+        return sum(self._counts)
+
+    def clear(self):
+        self._counts[:] = array("Q", bytes(8 * len(self._counts)))
+        self._instructions.clear()
+
+    def record(self, pc, instruction, ns):
+        """Count the instruction at ``pc`` whose action took ``ns``."""
+        self._counts[pc] += 1
+        stats = self._instructions.get(instruction)
+        if stats is None:
+            stats = self._instructions[instruction] = [0, 0]
+        stats[0] += 1
+        stats[1] += ns
+
+    def instructions(self):
+        """Return an ``InstructionProfile`` per instruction, slowest first."""
+        profiles = [InstructionProfile(instruction, count, ns / 1e9)
+                    for instruction, (count, ns)
+                    in self._instructions.items()]
+        profiles.sort(key=lambda profile: profile.seconds, reverse=True)
+        return profiles
+
+    def addresses(self):
+        """Return (address, count) of the executed addresses, hottest first."""
+        hits = [(address, count) for address, count
+                in enumerate(self._counts) if count]
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits
+
+    def annotate(self, assembler):
+        """Yield (count, line) per source line of ``assembler``.
+
+        The count is None for lines that assemble to no words.
+        """
+        counts = self._counts
+        for line_no, line in enumerate(assembler.lines):
+            address = assembler.address(line_no)
+            if assembler.address(line_no + 1) > address < len(counts):
+                yield counts[address], line
+            else:
+                yield None, line
+
+    def write_report(self, file, limit=20):
+        """Write the instructions and addresses that took the most time."""
+        total = self.total or 1
+        file.write(f"{'instruction':<16} {'count':>12} {'%':>6} "
+                   f"{'ms':>10} {'ns/call':>8}\n")
+        for instruction, count, seconds in self.instructions()[:limit]:
+            file.write(f"{str(instruction.syntax):<16} {count:>12} "
+                       f"{100 * count / total:>6.2f} {1e3 * seconds:>10.3f} "
+                       f"{1e9 * seconds / count:>8.0f}\n")
+        file.write(f"\n{'address':<16} {'count':>12} {'%':>6}\n")
+        for address, count in self.addresses()[:limit]:
+            file.write(f"0x{address:04X}{'':<10} {count:>12} "
+                       f"{100 * count / total:>6.2f}\n")
+
+    def write_listing(self, file, assembler):
+        """Write the source of ``assembler`` with each line's count."""
+        for count, line in self.annotate(assembler):
+            text = f"{'' if count is None else count:>12}  {line}"
+            file.write(text.rstrip() + "\n")
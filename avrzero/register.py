@@ -6,12 +6,19 @@ from avrzero.instruction import BYTE_SIZE
 class Register:
     N_BITS = BYTE_SIZE
 
-    def __init__(self, name=None, addr=None, val=None):
+    def __init__(self, name=None, addr=None, val=None, data=None):
         self._name = name
         self._addr = addr
-        if val is None:
-            val = randint(0, (1 << self.N_BITS) - 1)
-        self.val = val
+        if data is None:
+            self._data = bytearray(1)
+            self._idx = 0
+            if val is None:
+                val = randint(0, (1 << self.N_BITS) - 1)
+        else:
+            self._data = data
+            self._idx = addr
+        if val is not None:
+            self.val = val
 
     def __repr__(self):
         if self.addr is None:
@@ -42,11 +49,11 @@ class Register:
 
     @property
     def val(self):
-        return self._val
+        return self._data[self._idx]
 
     @val.setter
     def val(self, val):
-        self._val = val % (1 << self.N_BITS)
+        self._data[self._idx] = val % (1 << self.N_BITS)
 
     def __getitem__(self, idx):
         return (self.val & (1 << idx)) >> idx
@@ -63,7 +70,7 @@ class PointerRegister(Register):
     def __init__(self, name=None, pair=None):
         pair = tuple(pair)
         self._name = name
-        self._addr = (r.addr for r in pair)
+        self._addr = tuple(r.addr for r in pair)
         self._pair = pair
 
     def __repr__(self):
@@ -91,6 +98,27 @@ class PointerRegister(Register):
         r2.val = val & ((1 << r2.N_BITS) - 1)
 
 
+class AttributeRegister(Register):
+    N_BITS = BYTE_SIZE * 2
+
+    def __init__(self, name=None, owner=None, attr=None):
+        self._name = name
+        self._addr = None
+        self._owner = owner
+        self._attr = attr
+
+    def __repr__(self):
+        return f"AttributeRegister({self._attr!r}, {self.val:0{self.N_BITS}b})"
+
+    @property
+    def val(self):
+        return getattr(self._owner, self._attr)
+
+    @val.setter
+    def val(self, val):
+        setattr(self._owner, self._attr, val % (1 << self.N_BITS))
+
+
 class StatusRegister(Register):
     BIT_NAMES = (("C", "Carry flag"),
                  ("Z", "Zero flag"),
@@ -101,12 +129,60 @@ class StatusRegister(Register):
                  ("T", "Bit copy"),
                  ("I", "Interrupt flag"))
 
+    _lazy = False
+    _pending = None
+
     @classmethod
     def from_(cls, reg):
         reg._name = "status register"
         reg.__class__ = cls
         return reg
 
+    @property
+    def lazy(self):
+        return self._lazy
+
+    @lazy.setter
+    def lazy(self, lazy):
+        self.flush()
+        self._lazy = bool(lazy)
+
+    @property
+    def val(self):
+        if self._pending is not None:
+            self.flush()
+        return self._data[self._idx]
+
+    @val.setter
+    def val(self, val):
+        self._pending = None
+        self._data[self._idx] = val % (1 << self.N_BITS)
+
+    def defer(self, table, index):
+        """Update flags from ``table.table[index]``, now or when read.
+
+        In lazy mode only the latest operation is recorded, and the flags
+        are computed the next time the register is read. An earlier pending
+        operation is computed first unless ``table`` overwrites its flags.
+        """
+        if self._lazy:
+            if self._pending is not None and not table.overwrites:
+                self.flush()
+            self._pending = (table, index)
+        else:
+            entry = table.table[index]
+            data, idx = self._data, self._idx
+            data[idx] = data[idx] & entry >> 16 | entry >> 8 & 0xFF
+
+    def flush(self):
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            table, index = pending
+            entry = table.table[index]
+            data, idx = self._data, self._idx
+            data[idx] = data[idx] & entry >> 16 | entry >> 8 & 0xFF
+
 
 for i, (abbr, name) in enumerate(StatusRegister.BIT_NAMES):
     prop = property(lambda r, n=i: r.__getitem__(n),
@@ -0,0 +1,105 @@
+import glob
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+
+from avrzero import flags
+from avrzero.assembler import Assembler
+from avrzero.cache import AssemblyCache
+from avrzero.instruction import InstructionSet
+from avrzero.machine import Machine
+
+
+def find_sources(patterns, suffix=".asm"):
+    """Expand files, directories and glob patterns into source paths."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.extend(os.path.join(root, name) for name in files
+                             if name.endswith(suffix))
+        elif any(char in pattern for char in "*?["):
+            paths.extend(glob.glob(pattern, recursive=True))
+        else:
+            paths.append(pattern)
+    return sorted(set(paths))
+
+
+def warm_tables():
+    """Build the lazily computed tables now rather than on first use.
+
+    Run in each worker process so that the tables are built once per
+    worker, not once per file, and before profiling so that building them
+    is not charged to the first instruction that uses them.
+    """
+    InstructionSet.default.decode_table
+    flags.ADD.table
+
+
+def run_file(path, max_steps=None, timeout=None, engine="interpreter",
+             seed=None, cache_dir=None, max_cycles=None, coverage=False,
+             detect_loops=False):
+    """Assemble and run one source file, and return a JSON-ready result."""
+    start = perf_counter()
+    result = {"file": path}
+    try:
+        with open(path, "r") as asm_file:
+            asm_source = asm_file.read()
+    except (OSError, UnicodeDecodeError) as err:
+        result["error"] = str(err)
+        result["elapsed"] = perf_counter() - start
+        return result
+
+    cache = None if cache_dir is None else AssemblyCache(cache_dir)
+    assembler = Assembler(asm_source, cache=cache)
+    program = assembler.assemble()
+    result["errors"] = [[line_no + 1, message]
+                        for line_no, message in assembler.errors]
+    if not result["errors"]:
+        if seed is not None:
+            random.seed(seed)
+        machine = Machine(engine=engine)
+        machine.load_program(program)
+        if coverage:
+            machine.start_coverage()
+        if detect_loops:
+            machine.start_loop_detection()
+        run_result = machine.run(max_steps=max_steps, timeout=timeout,
+                                 max_cycles=max_cycles)
+        result.update(
+            reason=run_result.reason.value,
+            steps=run_result.steps,
+            cycles=run_result.cycles,
+            pc=machine.pc,
+            sp=machine.SP.val,
+            sreg=machine.SREG.val,
+            registers=list(machine.memory.data[0x00:0x20]),
+        )
+        if coverage:
+            result["missed_lines"] = [
+                line_no + 1
+                for line_no in machine.coverage.missed_lines(assembler)]
+    result["elapsed"] = perf_counter() - start
+    return result
+
+
+def run_files(paths, max_steps=None, timeout=None, engine="interpreter",
+              seed=None, cache_dir=None, workers=None, max_cycles=None,
+              coverage=False, detect_loops=False):
+    """Run source files in a process pool and yield results as they finish.
+
+    Only the path goes to a worker and only the result dictionary comes
+    back, so a submission is assembled in the process that runs it.
+    """
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=warm_tables) as executor:
+        futures = {executor.submit(run_file, path, max_steps, timeout,
+                                   engine, seed, cache_dir, max_cycles,
+                                   coverage, detect_loops): path
+                   for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as err:
+                yield {"file": futures[future], "error": repr(err)}
@@ -0,0 +1,133 @@
+import csv
+import json
+from array import array
+from collections import namedtuple
+
+from avrzero.instruction import SPH_ADDR, SPL_ADDR, SREG_ADDR
+
+TraceEntry = namedtuple("TraceEntry",
+                        ("step", "pc", "words", "instruction", "changes"))
+
+# the registers saved before each instruction, as (name, address)
+TRACED_REGISTERS = tuple((f"R{addr}", addr) for addr in range(0x20)) + (
+    ("SPL", SPL_ADDR), ("SPH", SPH_ADDR), ("SREG", SREG_ADDR))
+_STATE_SIZE = len(TRACED_REGISTERS)
+
+
+class TraceRecorder:
+    """The last ``depth`` instructions a machine executed.
+
+    For each instruction, the recorder stores the program counter, the two
+    flash words at it and the general purpose registers, SP and SREG before
+    it ran, in ring buffers allocated up front. The changes an instruction
+    made are the difference to the state saved for the next one, so they
+    are only worked out on export. Where recording stopped after an
+    instruction, ``end`` saves the state after it instead, so that nothing
+    executed untraced is counted as its changes.
+    """
+
+    def __init__(self, machine, depth=1 << 16):
+        if depth <= 0:
+            raise ValueError("invalid depth, expect a positive int")
+        self._machine = machine
+        self._depth = depth
+        self._pcs = array("H", bytes(2 * depth))
+        self._words = array("H", bytes(4 * depth))
+        self._states = bytearray(_STATE_SIZE * depth)
+        self._states_view = memoryview(self._states)
+        self._flash = machine.flash.view()
+        self._sreg = machine.SREG
+        view = memoryview(machine.memory.data)
+        self._registers = view[0x00:0x20]
+        self._io = view[SPL_ADDR:SREG_ADDR + 1]
+        # number of instructions recorded, including overwritten ones
+        self._total = 0
+        # step -> state after it, for the last step before each stop
+        self._ends = {}
+
+    def __len__(self):
+        return min(self._total, self._depth)
+
+    @property
+    def depth(self):
+        return self._depth
+
+    @property
+    def total(self):
+        return self._total
+
+    def clear(self):
+        self._total = 0
+        self._ends.clear()
+
+    def record(self, pc):
+        """Save the state before the instruction at ``pc`` runs."""
+        total = self._total
+        self._total = total + 1
+        index = total % self._depth
+        self._pcs[index] = pc
+        flash = self._flash
+        words = self._words
+        words[2 * index] = flash[pc]
+        words[2 * index + 1] = flash[pc + 1] if pc + 1 < len(flash) else 0
+        self._sreg.flush()
+        offset = index * _STATE_SIZE
+        states = self._states_view
+        states[offset:offset + 0x20] = self._registers
+        states[offset + 0x20:offset + _STATE_SIZE] = self._io
+
+    def end(self):
+        """Save the state after the last instruction recorded."""
+        step = self._total - 1
+        if step < 0 or step in self._ends:
+            return
+        first = self._total - len(self)
+        self._ends = {old: state for old, state in self._ends.items()
+                      if old >= first}
+        self._sreg.flush()
+        self._ends[step] = bytes(self._registers) + bytes(self._io)
+
+    def _state(self, index):
+        offset = index * _STATE_SIZE
+        return self._states[offset:offset + _STATE_SIZE]
+
+    def entries(self):
+        """Yield a ``TraceEntry`` per recorded instruction, oldest first."""
+        decode_table = self._machine.instruction_set.decode_table
+        self._machine.SREG.flush()
+        current = bytes(self._registers) + bytes(self._io)
+        first = self._total - len(self)
+        for step in range(first, self._total):
+            index = step % self._depth
+            word = self._words[2 * index]
+            instruction = decode_table[word]
+            n_words = 1 if instruction is None \
+                else instruction.opcode.n_words
+            before = self._state(index)
+            after = self._ends.get(step)
+            if after is None:
+                after = current if step + 1 == self._total \
+                    else self._state((step + 1) % self._depth)
+            changes = {name: (before[i], after[i])
+                       for i, (name, addr) in enumerate(TRACED_REGISTERS)
+                       if before[i] != after[i]}
+            yield TraceEntry(
+                step, self._pcs[index],
+                tuple(self._words[2 * index:2 * index + n_words]),
+                None if instruction is None else instruction.name,
+                changes)
+
+    def write_csv(self, file):
+        writer = csv.writer(file)
+        writer.writerow(("step", "pc", "words", "instruction", "changes"))
+        for step, pc, words, instruction, changes in self.entries():
+            writer.writerow((
+                step, f"0x{pc:04X}",
+                " ".join(f"{word:04X}" for word in words),
+                instruction or "",
+                " ".join(f"{name}={old:#04x}->{new:#04x}"
+                         for name, (old, new) in changes.items())))
+
+    def write_jsonl(self, file):
+        for entry in self.entries():
+            file.write(json.dumps(entry._asdict()) + "\n")
@@ -0,0 +1,166 @@
+import ast
+import builtins
+import inspect
+import textwrap
+from collections import namedtuple
+from functools import cache
+
+Block = namedtuple("Block",
+                   ("start", "stop", "n_steps", "n_cycles", "inner",
+                    "function", "source"))
+
+# statements that change control flow or scoping of an inlined action body
+_UNINLINABLE_NODES = (ast.Return, ast.Yield, ast.YieldFrom, ast.Await,
+                      ast.Global, ast.Nonlocal, ast.FunctionDef,
+                      ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda,
+                      ast.ExceptHandler)
+
+_MISSING = object()
+
+
+class _NotInlinable(Exception):
+    pass
+
+
+@cache
+def _action_source(action):
+    try:
+        return textwrap.dedent(inspect.getsource(action))
+    except (OSError, TypeError) as err:
+        raise _NotInlinable("source unavailable") from err
+
+
+class _Specializer(ast.NodeTransformer):
+
+    def __init__(self, constants, renames):
+        self._constants = constants
+        self._renames = renames
+
+    def visit_Name(self, node):
+        if node.id in self._constants:
+            if not isinstance(node.ctx, ast.Load):
+                raise _NotInlinable(f"operand {node.id} is assigned to")
+            constant = ast.Constant(self._constants[node.id])
+            return ast.copy_location(constant, node)
+        if node.id in self._renames:
+            node.id = self._renames[node.id]
+        return node
+
+
+class BlockTranslator:
+    MAX_BLOCK_STEPS = 64
+
+    def __init__(self, machine):
+        self._machine = machine
+        self._blocks = {}
+        machine.flash.add_listener(self._invalidate)
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def block(self, pc):
+        block = self._blocks.get(pc)
+        if block is None:
+            block = self.translate(pc)
+            if block is not None:
+                self._blocks[pc] = block
+        return block
+
+    def clear(self):
+        self._blocks.clear()
+
+    def _invalidate(self, start, stop):
+        for pc in [pc for pc, block in self._blocks.items()
+                   if pc < stop and start < block.stop]:
+            del self._blocks[pc]
+
+    def _decode_block(self, start):
+        flash = self._machine.flash
+        decode = self._machine.instruction_set.decode
+        pc = start
+        decoded = []
+        while len(decoded) < self.MAX_BLOCK_STEPS:
+            entry = decode(flash, pc)
+            if entry is None:
+                break
+            instruction, operand_map = entry
+            decoded.append((pc, instruction, operand_map))
+            pc += instruction.opcode.n_words
+            if instruction.branch:
+                break
+        return decoded, pc
+
+    def translate(self, start):
+        decoded, stop = self._decode_block(start)
+        if not decoded:
+            return None
+
+        name = f"block_0x{start:04X}"
+        namespace = {}
+        lines = [f"def {name}(machine):"]
+        for i, (pc, instruction, operand_map) in enumerate(decoded):
+            lines.append(f"    # 0x{pc:04X}: {instruction.name}")
+            action = self._machine.action_for(instruction)
+            try:
+                body = self._inline(action, operand_map, i, namespace)
+            except _NotInlinable:
+                action_name = f"_action_{i}"
+                namespace[action_name] = action
+                arguments = "".join(f", {key}={val!r}"
+                                    for key, val in operand_map.items())
+                body = f"{action_name}(machine{arguments})"
+            lines.extend("    " + line for line in body.splitlines())
+        source = "\n".join(lines) + "\n"
+
+        code = compile(source, f"<{name}>", "exec")
+        exec(code, namespace)
+        inner = frozenset(pc for pc, _, _ in decoded[1:])
+        n_cycles = sum(instruction.cycles for _, instruction, _ in decoded)
+        return Block(start, stop, len(decoded), n_cycles, inner,
+                     namespace[name], source)
+
+    @staticmethod
+    def _inline(action, operand_map, index, namespace):
+        if getattr(action, "__code__", None) is None:
+            raise _NotInlinable("not a Python function")
+        if action.__code__.co_freevars:
+            raise _NotInlinable("closure")
+        func, *_ = ast.parse(_action_source(action)).body
+        if not isinstance(func, ast.FunctionDef):
+            raise _NotInlinable("not a function definition")
+        args = func.args
+        if args.posonlyargs or args.vararg or args.kwonlyargs or args.kwarg:
+            raise _NotInlinable("unsupported parameters")
+        machine_arg, *operand_args = (arg.arg for arg in args.args)
+        if set(operand_args) != set(operand_map):
+            raise _NotInlinable("operands do not match parameters")
+
+        body = ast.Module(body=func.body, type_ignores=[])
+        for node in ast.walk(body):
+            if isinstance(node, _UNINLINABLE_NODES):
+                raise _NotInlinable(type(node).__name__)
+
+        # rename locals apart from other inlined bodies
+        local_names = {node.id for node in ast.walk(body)
+                       if isinstance(node, ast.Name)
+                       and not isinstance(node.ctx, ast.Load)}
+        renames = {local: f"{local}_{index}" for local in local_names}
+        renames[machine_arg] = "machine"
+        if machine_arg in local_names:
+            raise _NotInlinable("machine is assigned to")
+
+        # every remaining name must resolve like it does in the action
+        global_names = {node.id for node in ast.walk(body)
+                        if isinstance(node, ast.Name)} \
+            - local_names - set(operand_map) - {machine_arg}
+        for global_name in global_names:
+            val = action.__globals__.get(global_name, _MISSING)
+            if val is _MISSING:
+                val = getattr(builtins, global_name, _MISSING)
+            if val is _MISSING:
+                raise _NotInlinable(f"unresolved name {global_name}")
+            if namespace.setdefault(global_name, val) is not val:
+                raise _NotInlinable(f"conflicting name {global_name}")
+
+        body = _Specializer(operand_map, renames).visit(body)
+        return ast.unparse(ast.fix_missing_locations(body))
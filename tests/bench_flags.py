@@ -0,0 +1,83 @@
+"""Time the ADD and ADC actions against the per-bit flag code they replaced.
+
+Run from the root of the repository with ``python -m tests.bench_flags``.
+"""
+import random
+import timeit
+
+from avrzero.instruction import BYTE_SIZE, adc, add
+from avrzero.machine import Machine
+
+
+# the per-bit reference actions before the flag tables
+def per_bit_adc(machine, d, r):
+    Rd, Rr = machine.R[d], machine.R[r]
+    SREG = machine.SREG
+
+    R = (Rd.val + Rr.val + SREG.C) % (1 << BYTE_SIZE)
+    R3, R7 = R >> 3 & 1, R >> 7 & 1
+    SREG.H = Rd[3] and Rr[3] or Rr[3] and not R3 or not R3 and Rd[3]
+    SREG.O = Rd[7] and Rr[7] and not R7 or not Rd[7] and not Rr[7] and R7
+    SREG.N = R7
+    SREG.S = SREG.N != SREG.O
+    SREG.Z = R == 0
+    SREG.C = Rd[7] and Rr[7] or Rr[7] and not R7 or not R7 and Rd[7]
+    Rd.val = R
+
+    machine.PC.val += 1
+
+
+def per_bit_add(machine, d, r):
+    Rd, Rr = machine.R[d], machine.R[r]
+    SREG = machine.SREG
+
+    R = (Rd.val + Rr.val) % (1 << BYTE_SIZE)
+    R3, R7 = R >> 3 & 1, R >> 7 & 1
+    SREG.H = Rd[3] and Rr[3] or Rr[3] and not R3 or not R3 and Rd[3]
+    SREG.O = Rd[7] and Rr[7] and not R7 or not Rd[7] and not Rr[7] and R7
+    SREG.N = R7
+    SREG.S = SREG.N != SREG.O
+    SREG.Z = R == 0
+    SREG.C = Rd[7] and Rr[7] or Rr[7] and not R7 or not R7 and Rd[7]
+    Rd.val = R
+
+    machine.PC.val += 1
+
+
+def check(machine, per_bit, instruction):
+    """Make sure the per-bit and table actions agree on every input."""
+    for carry in range(2):
+        for rd in range(256):
+            for rr in range(256):
+                results = []
+                for action in (per_bit, instruction.action):
+                    machine.SREG.val = carry
+                    machine.R[3].val, machine.R[5].val = rd, rr
+                    action(machine, d=3, r=5)
+                    results.append((machine.R[3].val, machine.SREG.val))
+                if results[0] != results[1]:
+                    raise AssertionError(f"{instruction.name} differs on "
+                                         f"{carry}, {rd:#04x}, {rr:#04x}")
+
+
+def main(number=200_000, repeat=5):
+    random.seed(0)
+    machine = Machine()
+    print(f"{'':<6} {'per-bit':>10} {'table':>10} {'fast':>10}")
+    for per_bit, instruction in ((per_bit_add, add), (per_bit_adc, adc)):
+        check(machine, per_bit, instruction)
+        times = []
+        for action in (per_bit, instruction.action, instruction.fast_action):
+            machine.R[3].val, machine.R[5].val = 0x3C, 0xD9
+
+            def call():
+                action(machine, d=3, r=5)
+
+            best = min(timeit.repeat(call, number=number, repeat=repeat))
+            times.append(best / number * 1e6)
+        print(f"{instruction.name:<6} "
+              + " ".join(f"{time:>7.2f} us" for time in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Time ``run`` with watchpoints never armed, disarmed again, and armed.
+
+A machine whose watchpoints were all removed should run as fast as one
+that never had any. Run from the root of the repository with
+``python -m tests.bench_watch``.
+"""
+import random
+import timeit
+
+from avrzero.assembler import Assembler
+from avrzero.machine import Machine
+
+# pushes a return address of 0 and returns to it, forever
+PROGRAM = Assembler("\n".join((
+    "LDI R16, 0", "LDI R17, 0", "ADD R18, R19", "ADC R20, R18", "LD R0, X",
+    "PUSH R16", "PUSH R17", "RET"))).assemble()
+
+
+def make_machine(engine, watch):
+    random.seed(0)
+    machine = Machine(engine=engine)
+    machine.load_program(PROGRAM)
+    machine.X.val = 0x0100
+    if watch == "disarmed":
+        machine.unwatch(machine.watch(0x0100))
+    elif watch == "armed":
+        # watched, but never hit
+        machine.watch(0x0800)
+    return machine
+
+
+def main(max_steps=100_000, repeat=5):
+    print(f"{'':<12} " + " ".join(f"{watch:>12}" for watch in
+                                  ("never", "disarmed", "armed")))
+    for engine in Machine.ENGINES:
+        rates = []
+        for watch in ("never", "disarmed", "armed"):
+            machine = make_machine(engine, watch)
+
+            def call():
+                machine.run(max_steps=max_steps)
+
+            best = min(timeit.repeat(call, number=1, repeat=repeat))
+            rates.append(max_steps / best / 1e3)
+        print(f"{engine:<12} "
+              + " ".join(f"{rate:>8.0f} k/s" for rate in rates))
+
+
+if __name__ == "__main__":
+    main()
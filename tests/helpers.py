@@ -0,0 +1,56 @@
+import random
+
+from avrzero.error import AVRMachineError
+from avrzero.instruction import InstructionSet
+from avrzero.machine import Machine
+
+
+class ReferenceMachine(Machine):
+    """A machine that always runs the reference actions."""
+
+    def action_for(self, instruction):
+        return instruction.action
+
+
+def make_machine(seed, cls=Machine, program=(), **kwargs):
+    """Return a machine whose random initial memory depends on ``seed``."""
+    random.seed(seed)
+    machine = cls(**kwargs)
+    machine.load_program(program)
+    return machine
+
+
+def random_program(rng, n_words,
+                   instruction_set=InstructionSet.default):
+    """Return random instructions of ``n_words`` words or a word more.
+
+    Calls target addresses inside the program.
+    """
+    program = []
+    instructions = [instruction for name in ("ADC", "ADD", "BCLR", "CALL",
+                                             "LD", "LDI", "NOP", "POP",
+                                             "PUSH", "RET")
+                    for instruction in instruction_set.by_name(name)]
+    while len(program) < n_words:
+        instruction = rng.choice(instructions)
+        operand_map = {operand.name: rng.choice(operand.choices)
+                       for operand in instruction.operands}
+        if instruction.name == "CALL":
+            operand_map["k"] = rng.randrange(n_words)
+        program.extend(instruction.opcode.map_operands(operand_map))
+    return program
+
+
+def state(machine):
+    machine.SREG.flush()
+    return bytes(machine.memory.data), machine.pc
+
+
+def step_until_halt(machine, max_steps):
+    """Step up to ``max_steps`` times, return (steps, halted)."""
+    for steps in range(max_steps):
+        try:
+            machine.step()
+        except AVRMachineError:
+            return steps, True
+    return max_steps, False
@@ -0,0 +1,77 @@
+import io
+import random
+
+import pytest
+
+from avrzero.assembler import Assembler, IncrementalAssembler
+from avrzero.memory import Flash
+
+LINES = ("LDI R16, 200", "ADD R1, R2", "CALL 12", "CALL 0x1000", "NOP",
+         "LD R0, X+", "PUSH R31 ; save", "; comment", "", "  RET",
+         "LDI R16, 300", "FOO R1")
+
+
+def random_edit(rng, lines):
+    start = rng.randrange(len(lines) + 1)
+    stop = min(start + rng.randrange(4), len(lines))
+    lines[start:stop] = rng.choices(LINES, k=rng.randrange(4))
+
+
+def test_incremental_matches_full_assembly():
+    for seed in range(20):
+        rng = random.Random(seed)
+        lines = rng.choices(LINES, k=rng.randrange(30))
+        incremental = IncrementalAssembler("\n".join(lines))
+        for _ in range(50):
+            old_program = list(incremental.program)
+            random_edit(rng, lines)
+            source = "\n".join(lines)
+            start, stop = incremental.update(source)
+            assembler = Assembler(source)
+            program = assembler.assemble()
+            assert incremental.program == program, seed
+            assert incremental.errors == assembler.errors
+            # splitlines drops a last empty line
+            n_lines = len(assembler.lines)
+            assert [incremental.address(line_no)
+                    for line_no in range(n_lines + 1)] \
+                == [assembler.address(line_no)
+                    for line_no in range(n_lines + 1)]
+            # the words outside the changed range are left alone
+            assert program[:start] == old_program[:start]
+            assert program[stop:] == old_program[stop:]
+
+
+def test_iter_assemble_reads_files():
+    rng = random.Random(0)
+    lines = rng.choices(LINES, k=200)
+    assembler = Assembler("\n".join(lines))
+    program = assembler.assemble()
+    errors = assembler.errors
+    file = io.StringIO("".join(line + "\r\n" for line in lines),
+                       newline="")
+    words = []
+    for line_no, address, line_words in Assembler().iter_assemble(file):
+        assert address == assembler.address(line_no) == len(words)
+        words.extend(line_words)
+    assert words == program
+    reader = Assembler()
+    list(reader.iter_assemble(lines))
+    assert reader.errors == errors
+
+
+@pytest.mark.parametrize("size", (1, 7, 64, 1000))
+@pytest.mark.parametrize("chunk_size", (1, 3, 1 << 12))
+def test_write_flash_matches_assemble(size, chunk_size):
+    rng = random.Random(size)
+    source = "\n".join(rng.choices(LINES, k=40))
+    full = Assembler(source)
+    program = full.assemble()
+    flash = Flash(size)
+    flash[:] = [0xABCD] * size
+    assembler = Assembler()
+    n_words = assembler.write_flash(flash, source.splitlines(), chunk_size)
+    assert n_words == len(program)
+    # words past the end are dropped and the rest is cleared
+    assert flash[:] == (program + [0] * size)[:size]
+    assert assembler.errors == full.errors
@@ -0,0 +1,35 @@
+import random
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from avrzero.batch import BatchMachine
+
+from helpers import (ReferenceMachine, make_machine, random_program,
+                     step_until_halt)
+
+
+def test_lanes_match_reference():
+    for seed in range(60):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        max_steps = rng.randrange(1, 400)
+        random.seed(seed)
+        batch = BatchMachine(8)
+        batch.load_program(program)
+        machines = []
+        for lane in range(len(batch)):
+            machine = make_machine(seed, ReferenceMachine, program)
+            if lane % 2:
+                # lanes diverge on register contents
+                machine.memory.data[rng.randrange(32)] = rng.randrange(256)
+            batch.load_lane(lane, machine)
+            machines.append(machine)
+        batch.run(max_steps)
+        for lane, machine in enumerate(machines):
+            steps, halted = step_until_halt(machine, max_steps)
+            assert (bytes(machine.memory.data), machine.pc, steps, halted) \
+                == (batch.memory[lane].tobytes(), int(batch.pc[lane]),
+                    int(batch.steps[lane]), bool(batch.halted[lane])), \
+                (seed, lane)
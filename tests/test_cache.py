@@ -0,0 +1,61 @@
+import os
+
+from avrzero.assembler import Assembler
+from avrzero.cache import AssemblyCache
+from avrzero.instruction import InstructionSet
+
+SOURCE = "LDI R16, 200\nFOO R1\n; comment\nCALL 0x1000\nNOP"
+
+
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for name in os.listdir(directory))
+
+
+def test_evicts_least_recently_used_to_low_water(tmp_path):
+    cache = AssemblyCache(tmp_path, max_size=2000)
+    for key in range(200):
+        cache.put(str(key), list(range(20)), [], list(range(5)))
+    assert directory_size(tmp_path) <= 2000
+    assert cache.evictions > 0
+    assert cache.get("199") is not None
+    assert cache.get("0") is None
+    # a new cache over the same directory sees the entries left
+    assert len(AssemblyCache(tmp_path)) == len(cache)
+
+
+def test_replacing_an_entry_does_not_grow_the_size(tmp_path):
+    cache = AssemblyCache(tmp_path, max_size=200)
+    for _ in range(100):
+        cache.put("key", [1, 2, 3], [(1, "invalid line")], [0])
+    assert cache.evictions == 0
+    assert cache.get("key").errors == ((1, "invalid line"),)
+
+
+def assemble(cache, source=SOURCE):
+    assembler = Assembler(source, cache=cache)
+    program = assembler.assemble()
+    n_lines = len(assembler.lines)
+    return (program, assembler.errors,
+            [assembler.address(line_no) for line_no in range(n_lines + 1)])
+
+
+def test_assemble_hits_the_cache(tmp_path):
+    cache = AssemblyCache(tmp_path)
+    result = assemble(cache)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert assemble(cache) == result == assemble(None)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert assemble(cache, SOURCE + "\nRET") != result
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_damaged_entry_is_assembled_again(tmp_path):
+    cache = AssemblyCache(tmp_path)
+    result = assemble(cache)
+    key = cache.key(SOURCE, InstructionSet.default)
+    path = tmp_path / (key + AssemblyCache.SUFFIX)
+    path.write_bytes(path.read_bytes()[:-1])
+    assert assemble(cache) == result
+    assert (cache.hits, cache.misses) == (0, 2)
+    assert cache.get(key) is not None
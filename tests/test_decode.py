@@ -0,0 +1,61 @@
+import pytest
+
+from avrzero.error import AVRMachineError
+from avrzero.instruction import InstructionSet
+from avrzero.machine import Machine, StopReason
+
+from helpers import ReferenceMachine, make_machine
+
+UNDECODABLE = [
+    # a CALL cut off by the end of flash
+    {0xFFFF: 0x940E},
+    # a CALL to an address past the choices of k
+    {0x0000: 0x940E, 0x0001: 0xFFFF},
+]
+
+
+def load_words(flash, words):
+    for address, word in words.items():
+        flash[address] = word
+
+
+@pytest.mark.parametrize("words", UNDECODABLE)
+def test_decode_rejects_words(words):
+    flash = [0] * 0x10000
+    load_words(flash, words)
+    assert InstructionSet.default.decode(flash, min(words)) is None
+
+
+@pytest.mark.parametrize("words", UNDECODABLE)
+@pytest.mark.parametrize("engine", Machine.ENGINES)
+def test_run_halts(words, engine):
+    machine = make_machine(0, engine=engine)
+    load_words(machine.flash, words)
+    machine.pc = min(words)
+    result = machine.run(max_steps=10)
+    assert result.reason is StopReason.HALT
+    assert result.steps == 0
+    assert machine.pc == min(words)
+
+
+@pytest.mark.parametrize("words", UNDECODABLE)
+@pytest.mark.parametrize("cls", (Machine, ReferenceMachine))
+def test_step_raises(words, cls):
+    machine = make_machine(0, cls)
+    load_words(machine.flash, words)
+    machine.pc = min(words)
+    with pytest.raises(AVRMachineError):
+        machine.step()
+
+
+@pytest.mark.parametrize("words", UNDECODABLE)
+def test_batch_lanes_halt(words):
+    pytest.importorskip("numpy")
+    from avrzero.batch import BatchMachine
+
+    batch = BatchMachine(2)
+    load_words(batch.flash, words)
+    batch.pc[:] = min(words)
+    result = batch.run(10)
+    assert result.halted.all()
+    assert not result.steps.any()
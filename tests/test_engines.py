@@ -0,0 +1,60 @@
+import random
+
+import pytest
+
+from avrzero.assembler import Assembler
+from avrzero.machine import Machine
+
+from helpers import ReferenceMachine, make_machine, random_program, state
+
+
+def run_variant(seed, program, max_steps, cls=Machine, engine="interpreter",
+                lazy_flags=False):
+    machine = make_machine(seed, cls, program, engine=engine,
+                           lazy_flags=lazy_flags)
+    result = machine.run(max_steps=max_steps)
+    return state(machine), result.reason, result.steps, result.cycles
+
+
+def test_block_matches_interpreter():
+    for seed in range(30):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        max_steps = rng.randrange(1, 1000)
+        assert run_variant(seed, program, max_steps, engine="block") \
+            == run_variant(seed, program, max_steps), seed
+
+
+def test_block_stops_match_interpreter():
+    for seed in range(20):
+        rng = random.Random(seed)
+        program = random_program(rng, 40)
+        breakpoints = {rng.randrange(40) for _ in range(2)}
+        max_cycles = rng.randrange(1, 1500)
+        results = []
+        for engine in Machine.ENGINES:
+            machine = make_machine(seed, program=program, engine=engine)
+            result = machine.run(max_steps=500, breakpoints=breakpoints,
+                                 max_cycles=max_cycles)
+            results.append((state(machine), result.reason, result.steps,
+                            result.cycles))
+        assert results[0] == results[1], seed
+
+
+@pytest.mark.parametrize("cls", (Machine, ReferenceMachine))
+@pytest.mark.parametrize("line", ("LD R0, X", "LD R0, X+", "LD R0, -X"))
+def test_ld_advances(cls, line):
+    machine = make_machine(0, cls, Assembler(line).assemble())
+    machine.X.val = 0x0101
+    machine.step()
+    assert machine.pc == 1
+
+
+@pytest.mark.parametrize("engine", Machine.ENGINES)
+def test_fast_actions_match_reference(engine):
+    for seed in range(30):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        max_steps = rng.randrange(1, 1000)
+        assert run_variant(seed, program, max_steps, engine=engine) \
+            == run_variant(seed, program, max_steps, ReferenceMachine), seed
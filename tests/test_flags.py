@@ -0,0 +1,151 @@
+import random
+
+import pytest
+
+from avrzero import flags
+from avrzero.assembler import Assembler
+from avrzero.instruction import adc, add, bclr
+from avrzero.machine import Machine
+
+from helpers import ReferenceMachine, make_machine, random_program, state
+
+TABLES = (flags.ADD, flags.SUB, flags.SBC, flags.AND, flags.OR, flags.EOR)
+
+
+def bit(val, idx):
+    return val >> idx & 1
+
+
+def test_add_table_matches_manual():
+    for carry in range(2):
+        for rd in range(256):
+            for rr in range(256):
+                res = rd + rr + carry & 0xFF
+                h = (bit(rd, 3) & bit(rr, 3) | bit(rr, 3) & ~bit(res, 3)
+                     | ~bit(res, 3) & bit(rd, 3)) & 1
+                v = (bit(rd, 7) & bit(rr, 7) & ~bit(res, 7)
+                     | ~bit(rd, 7) & ~bit(rr, 7) & bit(res, 7)) & 1
+                c = (bit(rd, 7) & bit(rr, 7) | bit(rr, 7) & ~bit(res, 7)
+                     | ~bit(res, 7) & bit(rd, 7)) & 1
+                n = bit(res, 7)
+                sreg = (c | (res == 0) << 1 | n << 2 | v << 3
+                        | (n ^ v) << 4 | h << 5)
+                assert flags.ADD.lookup(rd, rr, carry) \
+                    == 0xC0 << 16 | sreg << 8 | res
+
+
+@pytest.mark.parametrize("operations, sreg", [
+    # AND keeps the C and H of the ADD
+    (((flags.ADD, 0xFF, 0x01, 0), (flags.AND, 0x0F, 0xF0, 0)), 0b00100011),
+    # SBC keeps the Z of the SUB on a zero result
+    (((flags.SUB, 5, 5, 0), (flags.SBC, 0, 0, 0)), 0b00000010),
+])
+def test_lazy_keeps_flags_that_the_next_table_keeps(operations, sreg):
+    for lazy in (False, True):
+        machine = make_machine(0, lazy_flags=lazy)
+        machine.SREG.val = 0
+        for table, rd, rr, carry in operations:
+            table.apply(machine.SREG, rd, rr, carry)
+        assert machine.SREG.val == sreg
+
+
+def test_lazy_matches_eager_on_random_operation_chains():
+    rng = random.Random(0)
+    machines = [make_machine(0, RAMEND=0xFF, lazy_flags=lazy)
+                for lazy in (False, True)]
+    for trial in range(3000):
+        operations = []
+        for _ in range(rng.randrange(1, 6)):
+            table = rng.choice(TABLES)
+            rd = rng.randrange(256)
+            # equal operands give the zero results that SBC treats apart
+            rr = rd if rng.random() < 0.3 else rng.randrange(256)
+            carry = rng.randrange(2) if table in (flags.ADD, flags.SBC) \
+                else 0
+            operations.append((table, rd, rr, carry, rng.random() < 0.3))
+        sreg = rng.randrange(256)
+        reads = []
+        for machine in machines:
+            SREG = machine.SREG
+            SREG.val = sreg
+            read = []
+            for table, rd, rr, carry, check in operations:
+                read.append(table.apply(SREG, rd, rr, carry))
+                if check:
+                    read.append(SREG.val)
+            read.append(SREG.val)
+            reads.append(read)
+        assert reads[0] == reads[1]
+
+
+@pytest.mark.parametrize("cls", (Machine, ReferenceMachine))
+def test_lazy_matches_eager_on_actions(cls):
+    rng = random.Random(1)
+    machines = [make_machine(0, cls, RAMEND=0xFF, lazy_flags=lazy)
+                for lazy in (False, True)]
+    for trial in range(3000):
+        operations = [(rng.choice((adc, add, bclr)), rng.randrange(32),
+                       rng.randrange(32), rng.randrange(8))
+                      for _ in range(4)]
+        memory = rng.randbytes(0x100)
+        results = []
+        for machine in machines:
+            machine.SREG.val = memory[0x5F]
+            machine.memory.data[:] = memory
+            reads = []
+            for instruction, d, r, s in operations:
+                action = machine.action_for(instruction)
+                if instruction is bclr:
+                    action(machine, s=s)
+                else:
+                    action(machine, d=d, r=r)
+                reads.append(machine.SREG.C)
+            results.append((reads, state(machine)))
+        assert results[0] == results[1]
+
+
+@pytest.mark.parametrize("cls", (Machine, ReferenceMachine))
+def test_lazy_flags_at_the_status_register_address(cls):
+    program = Assembler("\n".join((
+        "LDI R16, 200", "LDI R17, 100", "ADD R16, R17", "PUSH R16",
+        "POP R18", "ADD R16, R17", "LD R19, X", "ADD R16, R16",
+        "LD R20, -X", "LD R21, X+", "LD R22, X+"))).assemble()
+    states = []
+    for lazy in (False, True):
+        machine = make_machine(5, cls, program, lazy_flags=lazy)
+        # the push lands on SREG, and X points at it
+        machine.SP.val = 0x60
+        machine.X.val = 0x5F
+        machine.run(max_steps=11)
+        states.append(state(machine))
+    assert states[0] == states[1]
+
+
+@pytest.mark.parametrize("cls, engine", [
+    (ReferenceMachine, "interpreter"),
+    (Machine, "interpreter"),
+    (Machine, "block"),
+])
+def test_lazy_matches_eager_on_programs(cls, engine):
+    for seed in range(20):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        max_steps = rng.randrange(1, 1000)
+        results = []
+        for lazy in (False, True):
+            machine = make_machine(seed, cls, program, engine=engine,
+                                   lazy_flags=lazy)
+            result = machine.run(max_steps=max_steps)
+            results.append((state(machine), result.reason, result.steps))
+        assert results[0] == results[1], seed
+
+
+def test_lazy_flags_through_io_registers():
+    program = Assembler("LDI R16, 200\nLDI R17, 100\nADD R16, R17").assemble()
+    reads = []
+    for lazy in (False, True):
+        machine = make_machine(0, program=program, lazy_flags=lazy)
+        machine.SREG.val = 0
+        machine.run(max_steps=3)
+        reads.append(machine.IOR[0x3F].val)
+    assert reads == [0b00000001, 0b00000001]
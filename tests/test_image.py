@@ -0,0 +1,71 @@
+import io
+import random
+
+import pytest
+
+from avrzero.image import load_binary, load_hex, save_hex
+from avrzero.memory import Flash
+
+
+@pytest.mark.parametrize("image", (b"\x03", b"\x03\x00\x05", b"\x01\x02"))
+def test_binary_file_and_path_load_alike(tmp_path, image):
+    path = tmp_path / "image.bin"
+    path.write_bytes(image)
+    flashes = []
+    for file in (path, io.BytesIO(image)):
+        flash = Flash(4)
+        flash[:] = [0xABCD] * 4
+        assert load_binary(flash, file, 2) == len(image)
+        flashes.append(flash[:])
+    assert flashes[0] == flashes[1]
+    # only the words present in the image are touched
+    assert flashes[0][0] == flashes[0][3] == 0xABCD
+    if len(image) % 2:
+        assert flashes[0][1 + len(image) // 2] >> 8 == 0xAB
+
+
+def test_hex_round_trip_across_64_kib():
+    rng = random.Random(0)
+    flash = Flash(0x10000)
+    for address in range(0x7FE0, 0x8020):
+        flash[address] = rng.randrange(1, 0x10000)
+    flash[0xFFFF] = 0x1234
+    file = io.StringIO()
+    # 24 byte records do not end on the boundary by themselves
+    assert save_hex(flash, file, record_size=24) == 0x20000
+    text = file.getvalue()
+    assert ":020000040001F9\n" in text
+    assert text.endswith(":00000001FF\n")
+    loaded = Flash(0x10000)
+    assert load_hex(loaded, io.StringIO(text)) == 0x20000
+    assert loaded[:] == flash[:]
+
+
+def test_hex_extended_segment_address():
+    text = "\n".join((
+        # base 0x10000, then 4 bytes at 0x10002
+        ":020000021000EC", ":0400020001020304F0",
+        # back to base 0
+        ":020000020000FC", ":02000000AABB99", ":00000001FF"))
+    flash = Flash(0x10000)
+    assert load_hex(flash, io.StringIO(text)) == 6
+    assert flash[0x8001:0x8003] == [0x0201, 0x0403]
+    assert flash[0] == 0xBBAA
+
+
+@pytest.mark.parametrize("line, message", [
+    ("0400020001020304F0", "expect ':'"),
+    (":0400020001020304F1", "invalid checksum"),
+    (":0500020001020304EF", "invalid record length"),
+    (":0000", "invalid record length"),
+])
+def test_hex_rejects_records(line, message):
+    text = ":02000000AABB99\n" + line + "\n:00000001FF\n"
+    with pytest.raises(ValueError, match=f"line 2: {message}"):
+        load_hex(Flash(4), io.StringIO(text))
+
+
+def test_hex_image_must_fit_in_flash():
+    # 4 bytes at byte 6 of an 8 byte flash
+    with pytest.raises(ValueError, match="does not fit"):
+        load_hex(Flash(4), io.StringIO(":0400060001020304EC\n:00000001FF"))
@@ -0,0 +1,62 @@
+import pytest
+
+from avrzero.assembler import Assembler
+from avrzero.machine import Machine
+
+from helpers import ReferenceMachine, make_machine
+
+MACHINES = (Machine, ReferenceMachine)
+
+
+def assemble(*lines):
+    return Assembler("\n".join(lines)).assemble()
+
+
+@pytest.mark.parametrize("cls", MACHINES)
+@pytest.mark.parametrize("line", ("LD R0, X", "LD R0, X+", "LD R0, -X"))
+def test_ld_loads_data_memory(cls, line):
+    machine = make_machine(0, cls, assemble(line))
+    machine.X.val = 0x0100 + line.endswith("-X")
+    machine.memory.data[0x0100] = 0x42
+    machine.step()
+    assert machine.R[0].val == 0x42
+
+
+@pytest.mark.parametrize("cls", MACHINES)
+def test_add_ignores_carry(cls):
+    machine = make_machine(0, cls, assemble("ADD R16, R17"))
+    machine.SREG.val = 0b00000001
+    machine.R[16].val = machine.R[17].val = 0x01
+    machine.step()
+    assert machine.R[16].val == 0x02
+
+
+@pytest.mark.parametrize("cls", MACHINES)
+def test_adc_adds_carry(cls):
+    machine = make_machine(0, cls, assemble("ADC R16, R17"))
+    machine.SREG.val = 0b00000001
+    machine.R[16].val = machine.R[17].val = 0x01
+    machine.step()
+    assert machine.R[16].val == 0x03
+
+
+@pytest.mark.parametrize("cls", MACHINES)
+def test_add_flags(cls):
+    machine = make_machine(0, cls, assemble("ADD R16, R17"))
+    machine.SREG.val = 0
+    machine.R[16].val, machine.R[17].val = 0x7F, 0x01
+    machine.step()
+    assert machine.R[16].val == 0x80
+    # H, V and N
+    assert machine.SREG.val == 0b00101100
+
+
+@pytest.mark.parametrize("cls", MACHINES)
+def test_ret_pops_one_byte_at_a_time(cls):
+    machine = make_machine(0, cls, assemble("RET"))
+    # the second pop reads SPL after the first pop moved it
+    machine.SP.val = 0x5C
+    machine.memory.data[0x5C] = 0x00
+    machine.step()
+    assert machine.pc == 0x005D
+    assert machine.SP.val == 0x005E
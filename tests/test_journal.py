@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+from avrzero.assembler import Assembler
+from avrzero.machine import StopReason
+
+from helpers import make_machine, random_program, state, step_until_halt
+
+
+def full_state(machine):
+    return state(machine), machine.SP.val, machine.SREG.val, machine.cycles
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_step_back_restores_earlier_states(lazy):
+    for seed in range(20):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        machine = make_machine(seed, program=program, lazy_flags=lazy)
+        machine.start_journal()
+        states = [full_state(machine)]
+        for _ in range(rng.randrange(1, 300)):
+            if step_until_halt(machine, 1)[1]:
+                break
+            states.append(full_state(machine))
+        assert len(machine.journal) == len(states) - 1
+        while len(states) > 1:
+            n_steps = rng.randrange(1, len(states))
+            assert machine.step_back(n_steps) == n_steps
+            del states[-n_steps:]
+            assert full_state(machine) == states[-1], seed
+        assert machine.step_back() == 0
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_step_back_after_run(lazy):
+    for seed in range(10):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        machine = make_machine(seed, program=program, lazy_flags=lazy)
+        before = full_state(machine)
+        machine.start_journal()
+        result = machine.run(max_steps=rng.randrange(1, 500))
+        assert machine.step_back(result.steps) == result.steps
+        assert full_state(machine) == before, seed
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_halted_instruction_is_not_journaled(lazy):
+    # ends with a CALL to an address past the choices of k
+    program = Assembler("LDI R16, 10\nPUSH R16").assemble() \
+        + [0x940E, 0xFFFF]
+    for halt in ("step", "run"):
+        machine = make_machine(0, program=program, lazy_flags=lazy)
+        machine.start_journal()
+        states = [full_state(machine)]
+        for _ in range(2):
+            machine.step()
+            states.append(full_state(machine))
+        machine.step_back(2)
+        if halt == "step":
+            assert step_until_halt(machine, 10) == (2, True)
+        else:
+            assert machine.run().reason is StopReason.HALT
+        assert full_state(machine) == states[2]
+        assert len(machine.journal) == 2
+        assert machine.step_back() == 1
+        assert full_state(machine) == states[1]
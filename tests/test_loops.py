@@ -0,0 +1,32 @@
+import pytest
+
+from avrzero.assembler import Assembler
+from avrzero.machine import StopReason
+
+from helpers import make_machine
+
+# pushes a return address of 0 and returns to it
+LOOP = ("LDI R16, 0", "LDI R17, 0", "PUSH R16", "PUSH R17", "RET")
+# the same loop with a 16-bit counter in R18:R16, so no state repeats
+# within 65536 loops
+COUNTER = ("LDI R17, 1", "LDI R19, 0", "LDI R21, 0", "ADD R16, R17",
+           "ADC R18, R19", "PUSH R21", "PUSH R21", "RET")
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_repeated_state_is_non_terminating(lazy):
+    program = Assembler("\n".join(LOOP)).assemble()
+    machine = make_machine(0, program=program, lazy_flags=lazy)
+    machine.start_loop_detection()
+    result = machine.run(max_steps=1000)
+    assert result.reason is StopReason.NON_TERMINATING
+    assert result.steps < 100
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_counting_loop_runs_on(lazy):
+    program = Assembler("\n".join(COUNTER)).assemble()
+    machine = make_machine(0, program=program, lazy_flags=lazy)
+    machine.start_loop_detection()
+    result = machine.run(max_steps=20_000)
+    assert result.reason is StopReason.MAX_STEPS
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from avrzero.assembler import Assembler
+
+from helpers import make_machine, random_program, state
+
+
+def full_state(machine):
+    return (state(machine), machine.flash.tobytes(), machine.SP.val,
+            machine.SREG.val, machine.cycles)
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_restore_round_trip(lazy):
+    for seed in range(10):
+        rng = random.Random(seed)
+        program = random_program(rng, 60)
+        machine = make_machine(seed, program=program, lazy_flags=lazy)
+        machine.run(max_steps=rng.randrange(100))
+        snapshot = machine.snapshot()
+        before = full_state(machine)
+        max_steps = rng.randrange(1, 500)
+        machine.run(max_steps=max_steps)
+        after = full_state(machine)
+        machine.flash[rng.randrange(len(machine.flash))] = 0
+        machine.restore(snapshot)
+        assert full_state(machine) == before, seed
+        assert machine.snapshot() == snapshot
+        # the restored flash is decoded again
+        machine.run(max_steps=max_steps)
+        assert full_state(machine) == after, seed
+
+
+def test_restore_copies_changed_pages():
+    page = 256
+    machine = make_machine(0, program=Assembler("PUSH R16").assemble())
+    machine.SP.val = 0x0200
+    snapshot = machine.snapshot()
+    assert machine.restore(snapshot) == 0
+
+    # SP is on the first page and the pushed byte at 0x1FF on the second
+    machine.step()
+    assert machine.restore(snapshot) == 2 * page
+    assert machine.restore(snapshot) == 0
+    assert machine.SP.val == 0x0200 and machine.pc == 0
+
+    # a flash page holds 128 words
+    machine.flash[0] = machine.flash[0x1001] = 0xFFFF
+    assert machine.restore(snapshot) == 2 * page
+    assert machine.flash.tobytes() == snapshot.flash
+
+
+def test_restore_rejects_another_size():
+    snapshot = make_machine(0, RAMEND=0xFF).snapshot()
+    with pytest.raises(ValueError):
+        make_machine(0).restore(snapshot)
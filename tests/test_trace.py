@@ -0,0 +1,37 @@
+from avrzero.assembler import Assembler
+
+from helpers import make_machine
+
+PROGRAM = Assembler("\n".join((
+    "LDI R16, 1", "LDI R17, 2", "LDI R18, 3", "LDI R20, 9", "PUSH R20",
+    "LDI R21, 4", "NOP", "NOP"))).assemble()
+
+
+def changes(machine):
+    return [(entry.instruction, set(entry.changes))
+            for entry in machine.tracer.entries()]
+
+
+def test_untraced_steps_are_not_changes():
+    machine = make_machine(0, program=PROGRAM)
+    machine.start_trace()
+    machine.run(max_steps=3)
+    machine.stop_trace()
+    machine.run(max_steps=2)
+    assert changes(machine) == [("LDI", {"R16"}), ("LDI", {"R17"}),
+                                ("LDI", {"R18"})]
+
+    # the gap is now in the middle of the ring
+    machine.start_trace()
+    machine.step()
+    assert changes(machine) == [("LDI", {"R16"}), ("LDI", {"R17"}),
+                                ("LDI", {"R18"}), ("LDI", {"R21"})]
+
+
+def test_halt_ends_segment():
+    machine = make_machine(0, program=PROGRAM[:2])
+    machine.flash[1] = 0xFFFF
+    machine.start_trace()
+    machine.run(max_steps=3)
+    machine.R[16].val = 0x55
+    assert changes(machine) == [("LDI", {"R16"}), (None, set())]
@@ -0,0 +1,89 @@
+import pytest
+
+from avrzero.assembler import Assembler
+from avrzero.machine import StopReason, WatchHit
+from avrzero.memory import MemoryBuffer, WatchedMemoryBuffer
+
+from helpers import make_machine
+
+PROGRAM = Assembler("\n".join((
+    "LDI R16, 200", "LDI R26, 0", "LDI R27, 1", "LD R0, X", "PUSH R16",
+    "ADD R16, R16", "POP R1"))).assemble()
+
+
+def run_watched(*args, lazy=False, **kwargs):
+    machine = make_machine(0, program=PROGRAM, lazy_flags=lazy)
+    machine.SP.val = 0x0200
+    machine.watch(*args, **kwargs)
+    result = machine.run(max_steps=len(PROGRAM))
+    return machine, result
+
+
+def test_watch_swaps_the_buffer_class():
+    machine = make_machine(0, program=PROGRAM)
+    data = machine.memory.data
+    watchpoint = machine.watch(0x100)
+    assert machine.memory.data is data
+    assert isinstance(data, WatchedMemoryBuffer)
+    machine.unwatch(watchpoint)
+    assert machine.memory.data is data
+    assert type(data) is MemoryBuffer
+
+
+def test_read_and_write_hits():
+    machine, result = run_watched(0x0100, read=True, write=False)
+    assert result.reason is StopReason.WATCHPOINT
+    assert result.steps == 4
+    assert machine.watch_hits \
+        == (WatchHit(3, 0x0100, "read", machine.R[0].val),)
+
+    # the PUSH decrements SP before storing
+    machine, result = run_watched(0x01FF)
+    assert result.reason is StopReason.WATCHPOINT
+    assert result.steps == 5
+    assert machine.watch_hits == (WatchHit(4, 0x01FF, "write", 200),)
+
+    # and the POP reads the byte back
+    machine, result = run_watched(0x01FF, read=True, write=False)
+    assert result.steps == 7
+    assert machine.watch_hits == (WatchHit(6, 0x01FF, "read", 200),)
+
+
+@pytest.mark.parametrize("target, steps, addresses", [
+    ("X", 2, (26,)),
+    ("SP", 5, (0x5E, 0x5D)),
+    ("SREG", 6, (0x5F,)),
+])
+@pytest.mark.parametrize("lazy", (False, True))
+def test_register_targets(target, steps, addresses, lazy):
+    machine = make_machine(0, program=PROGRAM, lazy_flags=lazy)
+    machine.SP.val = 0x0200
+    machine.SREG.val = 0
+    machine.watch(getattr(machine, target))
+    result = machine.run(max_steps=len(PROGRAM))
+    assert result.reason is StopReason.WATCHPOINT
+    assert result.steps == steps
+    hits = machine.watch_hits
+    assert tuple(hit.address for hit in hits) == addresses
+    assert all(hit.pc == steps - 1 and hit.access == "write"
+               for hit in hits)
+
+
+@pytest.mark.parametrize("lazy", (False, True))
+def test_disarming_restores_lazy_flags(lazy):
+    machine = make_machine(0, program=PROGRAM, lazy_flags=lazy)
+    watchpoints = [machine.watch(0x100), machine.watch(machine.SREG)]
+    assert not machine.SREG.lazy
+    machine.unwatch(watchpoints[0])
+    assert not machine.SREG.lazy
+    machine.unwatch(watchpoints[1])
+    assert machine.SREG.lazy == lazy
+
+
+def test_unwatched_run_stops_at_max_steps():
+    machine = make_machine(0, program=PROGRAM)
+    machine.SP.val = 0x0200
+    machine.unwatch(machine.watch(0x01FF))
+    result = machine.run(max_steps=len(PROGRAM))
+    assert result.reason is StopReason.MAX_STEPS
+    assert machine.watch_hits == ()